@@ -30,6 +30,19 @@ class PaxCommand(MuxCommand):
 
         return Notification.config(self.caller, "width", default=width)
 
+    def get_height(self):
+        """
+        Returns the user's preferred display height, or our best guess.
+        :return: A height, in lines.
+        """
+        height = 24
+        sessions = self.caller.sessions.get()
+        if len(sessions) > 0:
+            height = sessions[0].protocol_flags['SCREENHEIGHT'][0] \
+                if 'SCREENHEIGHT' in sessions[0].protocol_flags else 24
+
+        return Notification.config(self.caller, "height", default=height)
+
     def notify(self, text, style="response", **kwargs):
         """
         Displays the given text via the Notification class, as a shortcut.
@@ -20,6 +20,8 @@ https://github.com/evennia/evennia/wiki/evennia.commands.default.muxcommand
 from evennia.server.sessionhandler import SESSIONS
 from evennia.utils import utils, evtable, search
 from utils.notifications import Notification as Note
+from utils.text import display_width
+from utils.presence import PRESENCE
 from commands.command import PaxCommand
 import time
 import datetime
@@ -205,8 +207,8 @@ class CmdFinger(PaxCommand):
                 # First let's find out what our widest field name is.
                 widest_field = 5
                 for field, _ in target_player.db.finger_extra_fields.iteritems():
-                    if len(field) > widest_field:
-                        widest_field = len(field)
+                    if display_width(field) > widest_field:
+                        widest_field = display_width(field)
 
                 # Now we're adding a column to the table that has the appropriate
                 # width, so it's as small as it can be.
@@ -230,11 +232,11 @@ class CmdWho(PaxCommand):
     doing/set [pithy quote]
 
     This command shows who is presently online.  If a prefix is given, it will
-    only show the accounts whose names start with that prefix.  For admins, if
-    you wish to see the player-side list, type 'doing'.  For all players, if
-    you'd like to set a pithy quote to show up in the last column, use
-    'doing/set'.  If you don't provide a value to doing/set, it will clear
-    yours.
+    only show the accounts whose names start with that prefix, ignoring case.
+    For admins, if you wish to see the player-side list, type 'doing'.  For
+    all players, if you'd like to set a pithy quote to show up in the last
+    column, use 'doing/set'.  If you don't provide a value to doing/set, it
+    will clear yours.
     """
 
     key = "who"
@@ -266,21 +268,16 @@ class CmdWho(PaxCommand):
                 self.notify("Doing field set: {}".format(self.args))
                 self.account.db.who_doing = self.args
 
+            PRESENCE.refresh_account(self.account)
+
             # If we were just setting our doing, we're done now, so return
             return
 
-        if self.args:
-            session_list = [session for session in SESSIONS.get_sessions()
-                            if session.get_account().key.startswith(self.args)]
-        else:
-            session_list = SESSIONS.get_sessions()
-
-        # Sort the list by the time connected
-        #
-        # To read more on lambdas, check out:
-        # https://www.programiz.com/python-programming/anonymous-function
+        # Get the logged-in sessions, in the order they connected.  These come from a snapshot
+        # that's kept up to date as people connect, so we don't have to look at every session.
+        # You can find it in utils/presence.py
         #
-        session_list = sorted(session_list, key=lambda sess: sess.conn_time)
+        session_list = PRESENCE.who(self.args)
 
         # If our command was 'doing', we never show the admin version of things.
         # Otherwise, we check if the account has Developer or Admins permissions.
@@ -314,65 +311,31 @@ class CmdWho(PaxCommand):
             table.add_column("|wDoing|n")
 
         # Iterate across the sessions
-        for session in session_list:
-
-            # If this session isn't logged in -- i.e. is at the login screen
-            # or something -- just skip it.
-            if not session.logged_in:
-                continue
+        now = time.time()
+        for row in session_list:
 
             # How long has it been since their last command?
             #
-            delta_cmd = time.time() - session.cmd_last_visible
+            delta_cmd = now - row.cmd_last_visible
 
             # How long has this session been connected?
             #
-            delta_conn = time.time() - session.conn_time
-
-            account = session.get_account()
-            account_name = account.key
-
-            # If the 'who_doing' Evennia attribute on the account isn't empty,
-            # let's store it in a new variable called doing_string, otherwise
-            # let's store an empty string.
-            #
-            # The format we're using here is called a 'ternary conditional operator',
-            # and you can read a bit more about it at:
-            # https://www.pythoncentral.io/one-line-if-statement-in-python-ternary-conditional-operator/
-            #
-            doing_string = account.db.who_doing if account.db.who_doing else ""
-
-            # Get the Character that this Account is using.
-            character = session.get_puppet()
+            delta_conn = now - row.conn_time
 
             # Now we have all our data gathered!  Let's add a row to the table
             if show_admin_data:
-                if session.protocol_key == "websocket" or "ajax" in session.protocol_key:
-                    client_name = "Web Client"
-                else:
-                    # Get a sane client name to display.
-                    client_name = session.protocol_flags['CLIENTNAME']
-                    if not client_name:
-                        client_name = session.protocol_flags['TERM']
-                    if client_name.upper().endswith("-256COLOR"):
-                        client_name = client_name[:-9]
-
-                if client_name is None:
-                    client_name = "Unknown"
-
-                client_name = client_name.capitalize()
-
-                table.add_row(utils.crop(account_name, 20),
+                character = row.puppet
+                table.add_row(row.name,
                               utils.time_format(delta_conn, 0),
                               utils.time_format(delta_cmd, 1),
-                              "#{}".format(character.location.id) if character else "",
-                              client_name,
-                              session.address[0] if isinstance(session.address, tuple) else session.address)
+                              "#{}".format(character.location.id) if character and character.location else "",
+                              row.client,
+                              row.address)
             else:
-                table.add_row(utils.crop(account_name, 20),
+                table.add_row(row.name,
                               utils.time_format(delta_conn, 0),
                               utils.time_format(delta_cmd, 1),
-                              doing_string)
+                              row.doing)
 
         # Send the table to our user as a notification
         notification.add_line(str(table))
@@ -384,9 +347,11 @@ class CmdWho(PaxCommand):
 class CmdWhere(PaxCommand):
     """
     where
+    where/count
 
-    This command shows you where all the online players are gathered.  It
-    could stand to be made more advanced.
+    This command shows you where all the online players are gathered.  With
+    the count switch, it just shows how many players are in each room, busiest
+    first.
     """
 
     key = "where"
@@ -413,21 +378,23 @@ class CmdWhere(PaxCommand):
         # utils/notifications.py
         notification = self.get_notification(header="Where Is Everyone?", border=True)
 
-        # Get a list of all the rooms for online players
-        rooms = [session.get_puppet().location for session in SESSIONS.get_sessions() if session.get_puppet()]
-
-        # Turn our list into a set, so each room only appears once
-        rooms = set(rooms)
+        # Get the rooms which have online players in them.  These come from an index that's
+        # kept up to date as players connect and move around, so we don't have to search
+        # through every room's contents.  You can find it in utils/presence.py
+        rooms = PRESENCE.where()
 
         # Create a table to display our list.
         table = evtable.EvTable(border="none", width=notification.width)
 
-        for room in rooms:
-            # Get our players
-            players = [obj for obj in room.contents if obj.is_typeclass("typeclasses.characters.Character")]
-            # Get their names, and join them into a comma-delimited list
-            player_names = string.join([player.key for player in players], ", ")
-            table.add_row("|w" + room.key + ":|n", player_names)
+        if "count" in self.switches:
+            # Busiest rooms first, then alphabetically
+            for room, players in sorted(rooms.items(), key=lambda item: (-len(item[1]), item[0].key)):
+                table.add_row("|w" + room.key + ":|n", str(len(players)))
+        else:
+            for room, players in sorted(rooms.items(), key=lambda item: item[0].key):
+                # Get their names, and join them into a comma-delimited list
+                player_names = string.join([player.key for player in players], ", ")
+                table.add_row("|w" + room.key + ":|n", player_names)
 
         # Stuff our table into the notification
         notification.add_line(str(table))
@@ -7,7 +7,7 @@ and to ignore various global notification types.
 """
 
 from commands.command import PaxCommand
-from utils.notifications import Notification
+from utils.notifications import Notification, NotificationPrefs
 from evennia.utils.evtable import EvTable
 from evennia.utils.ansi import strip_ansi
 import string
@@ -18,6 +18,7 @@ class CmdDisplay(PaxCommand):
     display
     display/border [color]
     display/width [columns]
+    display/height [lines]
     display/prefix <type>[=<prefix>]
     display/ignore <type>
     display/unignore <type>
@@ -27,10 +28,12 @@ class CmdDisplay(PaxCommand):
     this command will show your current display preferences.  With the border
     switch, the given color string will be used to set the color you'd like
     borders to appear in.  Width will set your preferred display width; if not
-    set, it will try to default to your client's width. Prefix will set a
-    prefix to be prepended to all notification lines of a given type.  Ignore
-    and unignore will prevent you from seeing any unsolicited messages of the
-    given type.  The last command will list all known types of display.
+    set, it will try to default to your client's width.  Height does the same
+    for the number of lines, which sets how long paged lists (such as bboard
+    listings) can be.  Prefix will set a prefix to be prepended to all
+    notification lines of a given type.  Ignore and unignore will prevent you
+    from seeing any unsolicited messages of the given type.  The last command
+    will list all known types of display.
 
     """
 
@@ -38,6 +41,8 @@ class CmdDisplay(PaxCommand):
     locks = "cmd:all()"
 
     def func(self):
+        # Always start from what's stored, in case the preferences were changed some other way.
+        NotificationPrefs.invalidate(self.caller)
 
         if "types" in self.switches:
             note = self.get_notification(border=True,header="Notification Types")
@@ -81,6 +86,20 @@ class CmdDisplay(PaxCommand):
                 self.notify("Width reset to default behavior.")
                 return
 
+        elif "height" in self.switches:
+            if self.args:
+                try:
+                    height = int(self.args)
+                    Notification.set_config(self.caller, "height", height)
+                    self.notify("Height set to " + self.args)
+                except ValueError:
+                    self.notify("Height must be a number.")
+                return
+            else:
+                Notification.set_config(self.caller, "height", None)
+                self.notify("Height reset to default behavior.")
+                return
+
         elif "prefix" in self.switches:
             if not self.args:
                 self.notify("You must provide at least a notification type.")
@@ -143,11 +162,13 @@ class CmdDisplay(PaxCommand):
 
             border = Notification.config(self.caller, "border", default="Default") or "Default"
             width = Notification.config(self.caller, "width", default=78)
+            height = Notification.config(self.caller, "height", default="Default")
             prefixes = Notification.config(self.caller, "prefixes", default={})
             ignored = Notification.config(self.caller, "ignored", default=[])
 
             table.add_row("Border Color", border.replace("|", "||"))
             table.add_row("Display Width", str(width))
+            table.add_row("Display Height", str(height))
             if len(prefixes) > 0:
                 subtable = EvTable(border=None, width=self.get_width() - 4)
                 min_width = 5
@@ -0,0 +1,76 @@
+"""
+Benchmarks for the Markdown renderer.
+
+These are not part of the normal test run.  To run them, use:
+
+    evennia test markdown.benchmarks
+
+"""
+from __future__ import print_function
+
+import io
+import json
+import random
+import time
+
+from django.test import SimpleTestCase
+
+from markdown import parser
+from markdown.parser import MarkdownParser, MushRenderer
+from markdown.tests import GOLDEN_PATH
+
+POST_SIZES = (2048, 4096, 6144)
+REPEATS = 50
+
+
+def make_post(size, rng):
+    """
+    Builds a post of roughly the given size out of the golden corpus samples.
+
+    :param size: The length of the post, in characters.
+    :param rng: The random.Random to pick samples with.
+    :return: The post's Markdown text.
+    """
+    with io.open(GOLDEN_PATH, encoding="utf-8") as f:
+        samples = [case["markdown"] for case in json.load(f) if case["markdown"].strip()]
+
+    parts = []
+    length = 0
+    while length < size:
+        sample = rng.choice(samples)
+        parts.append(sample)
+        length += len(sample) + 2
+
+    return u"\n\n".join(parts)
+
+
+def measure(func, repeats=REPEATS):
+    """
+    Runs a function several times and returns the average time it took.
+
+    :param func: The function to run.
+    :param repeats: How many times to run it.
+    :return: Seconds per call.
+    """
+    start = time.time()
+    for _ in range(repeats):
+        func()
+
+    return (time.time() - start) / repeats
+
+
+class BenchmarkRenderer(SimpleTestCase):
+
+    def test_render_throughput(self):
+        rng = random.Random(1066)
+
+        print()
+        for size in POST_SIZES:
+            text = make_post(size, rng)
+            html = MarkdownParser(text).as_html()
+
+            full = measure(lambda: (parser._recent.clear(), MarkdownParser(text).as_mush()))
+            render = measure(lambda: MushRenderer().render(html))
+            cached = measure(lambda: MarkdownParser(text).as_mush())
+            print("%5d byte post: %7.2f ms total (%6.1f posts/s), %7.2f ms rendering HTML to MUSH, "
+                  "%5.3f ms when remembered" % (len(text), full * 1000, 1 / full, render * 1000, cached * 1000))
@@ -0,0 +1,80 @@
+"""
+A cache for rendered Markdown, so that text which rarely changes (such as bboard posts) isn't
+run through the parser every time it's shown.
+
+Renderings are kept in the 'markdown' cache from Django's CACHES setting, or the default
+cache if there isn't one.  Each is stored along with a hash of the text it was made from, so a
+stale rendering is never returned even if the text changes without the entry being
+invalidated.
+"""
+import hashlib
+
+from django.core.cache import caches, InvalidCacheBackendError
+from .parser import MarkdownParser
+
+_cache = None
+
+
+def get_cache():
+    """
+    Returns the cache used for rendered Markdown.
+    """
+    global _cache
+    if _cache is None:
+        try:
+            _cache = caches['markdown']
+        except InvalidCacheBackendError:
+            _cache = caches['default']
+
+    return _cache
+
+
+def _render(kind, text, key):
+    raw = text.encode('utf-8') if isinstance(text, unicode) else text
+    digest = hashlib.sha1(raw).hexdigest()
+    name = "markdown:" + kind + ":" + (str(key) if key is not None else digest)
+
+    cache = get_cache()
+    entry = cache.get(name)
+    if entry and entry[0] == digest:
+        return entry[1]
+
+    parser = MarkdownParser(text)
+    result = parser.as_mush() if kind == "mush" else parser.as_html()
+
+    cache.set(name, (digest, result), None)
+    return result
+
+
+def as_mush(text, key=None):
+    """
+    Renders Markdown text into Evennia color codes, using a cached copy if there is one.
+
+    :param text: The Markdown text to render.
+    :param key: An identifier for the text, such as a post id; if not given, the text is
+                cached by its contents alone.
+    :return: The rendered text.
+    """
+    return _render("mush", text, key)
+
+
+def as_html(text, key=None):
+    """
+    Renders Markdown text into HTML, using a cached copy if there is one.
+
+    :param text: The Markdown text to render.
+    :param key: An identifier for the text, such as a post id; if not given, the text is
+                cached by its contents alone.
+    :return: The rendered HTML.
+    """
+    return _render("html", text, key)
+
+
+def invalidate(key):
+    """
+    Drops any cached renderings for the given identifier, such as when a post is edited or
+    deleted.
+
+    :param key: The identifier the text was cached under.
+    """
+    get_cache().delete_many(["markdown:mush:" + str(key), "markdown:html:" + str(key)])
@@ -1,123 +1,295 @@
 import markdown2
-from bs4 import BeautifulSoup
+from HTMLParser import HTMLParser
+from htmlentitydefs import name2codepoint
+from collections import OrderedDict
+from threading import Lock
 from evennia.utils.ansi import strip_ansi
 
+# How many recently rendered strings to remember.  Repeated renders of the same text, such as
+# help entries or pinned posts, skip conversion entirely while it's remembered.
+RECENT_SIZE = 256
 
-class MarkdownParser:
+_recent = OrderedDict()
+# Web pages are rendered in worker threads, alongside the reactor, and OrderedDict isn't safe
+# to change from more than one thread at once.
+_recent_lock = Lock()
 
-    def __init__(self, original):
-        self.text = ""
+
+def _remember(text):
+    """
+    Gets the remembered conversions for a string, moving it to the most recently used end of
+    the cache and dropping the least recently used string if the cache is full.
+
+    :param text: The original Markdown text.
+    :return: A dictionary of the conversions made so far.
+    """
+    with _recent_lock:
+        entry = _recent.pop(text, None)
+        if entry is None:
+            entry = {}
+            while len(_recent) >= RECENT_SIZE:
+                _recent.popitem(last=False)
+
+        _recent[text] = entry
+
+    return entry
+
+
+class MushRenderer(HTMLParser):
+    """
+    Turns the HTML made by markdown2 into Evennia color codes in a single pass over the HTML
+    parser's events.  Rather than building a document tree and walking it, this keeps only the
+    stack of currently open tags, and collects output in a list that is joined once at the end.
+
+    Malformed HTML is handled the same way BeautifulSoup's html.parser builder handles it, so
+    that raw HTML in a post renders as it always has.
+    """
+
+    # Tags which never have contents, and so are closed as soon as they're opened.
+    void_tags = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link',
+                           'menuitem', 'meta', 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound',
+                           'command', 'frame', 'image', 'isindex', 'nextid', 'spacer'])
+
+    entities = dict((name, unichr(codepoint)) for name, codepoint in name2codepoint.items())
+    entities['apos'] = u"'"
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.parts = []
+        self.last = None
+        self.data = []
         self.tags = []
+        self.hrefs = []
         self.indent = 0
         self.counters = []
+        self.closed_void = []
+
+    def render(self, html):
+        """
+        Renders a complete HTML document.
+
+        :param html: The HTML to render.
+        :return: The rendered text, ending in a single line break.
+        """
+        self.feed(html)
+        self.close()
+        self.flush()
+        while self.tags:
+            self.end_tag()
+
+        text = u"".join(self.parts).strip()
+        while text.rstrip().endswith("|/"):
+            text = text.rstrip()[:-2]
+
+        return text + "|/"
+
+    def emit(self, text):
+        if text:
+            self.parts.append(text)
+            self.last = text[-1]
+
+    def flush(self):
+        """
+        Renders the text collected since the last tag as a single run of text.
+        """
+        if not self.data:
+            return
+
+        x = u"".join(self.data)
+        self.data = []
+
+        tags = self.tags
+        tag = tags[-1] if tags else ""
+        uptag = tags[-2] if len(tags) > 1 else ""
+        if tag != "pre" and uptag != "pre":
+            x = x.replace("\n", " ")
+        if not x.isspace():
+            if tag == "h1":
+                self.emit("|/|w" + x.upper() + "|n|/")
+            elif tag == "h2":
+                self.emit("|/|w|u" + x + "|n|/")
+            elif tag in ("h3", "h4", "h5"):
+                self.emit("|/|w" + x + "|n|/")
+            elif tag == "strong":
+                self.emit("|w" + x + "|n")
+            elif tag == "em":
+                self.emit("|u" + x + "|n")
+            else:
+                self.emit(x)
+
+    def start_tag(self, name, attrs):
+        self.flush()
+        tags = self.tags
+        tags.append(name)
+        self.hrefs.append(dict(attrs).get('href') if name == "a" else None)
+
+        if name == "ul":
+            self.indent += 1
+            if len(tags) >= 2 and tags[-2] == "li":
+                self.emit("|/")
+        elif name == "ol":
+            self.indent += 1
+            self.counters.append(1)
+            if len(tags) >= 2 and tags[-2] == "li":
+                self.emit("|/")
+        elif name == "li":
+            if len(tags) == 1 or not tags[-2] == "ol":
+                self.emit("|/" + ("  " * self.indent) + "* ")
+            else:
+                counter = self.counters[-1]
+                self.emit("|/" + ("  " * self.indent) + "{}. ".format(counter))
+                self.counters[-1] = counter + 1
+        elif name == "p":
+            if len(tags) == 1 or (not tags[-2] == "blockquote" and not tags[-2] == "li"):
+                self.emit("|/")
+        elif name == "pre":
+            self.emit("|/")
+        elif name == "blockquote":
+            self.emit("|/> ")
+
+    def end_tag(self):
+        self.flush()
+        tags = self.tags
+        name = tags.pop()
+        href = self.hrefs.pop()
+
+        if name == "ul":
+            self.indent -= 1
+        elif name == "ol":
+            self.indent -= 1
+            self.counters.pop()
+        elif name == "li":
+            self.emit("|/")
+        elif name == "p":
+            if len(tags) == 0 or (not tags[-1] == "blockquote" and not tags[-1] == "li"):
+                self.emit("|/")
+        elif name == "pre":
+            self.emit("|/")
+        elif name == "blockquote":
+            self.emit("|/")
+        elif name == "a":
+            if href:
+                if self.last != ' ':
+                    self.emit(" ")
+                self.emit("(" + href + ")")
+
+    def handle_starttag(self, name, attrs):
+        self.start_tag(name, attrs)
+        if name in self.void_tags:
+            self.end_tag()
+            # A later explicit end tag for this is redundant.
+            self.closed_void.append(name)
 
-        self.html = None
-        self.formatted = None
+    def handle_startendtag(self, name, attrs):
+        self.start_tag(name, attrs)
+        self.handle_endtag(name)
 
+    def handle_endtag(self, name):
+        if name in self.closed_void:
+            self.closed_void.remove(name)
+        elif name in self.tags:
+            # Close everything that was left open inside this tag, too.
+            while self.tags[-1] != name:
+                self.end_tag()
+            self.end_tag()
+        else:
+            self.flush()
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def handle_entityref(self, name):
+        self.data.append(self.entities.get(name, "&" + name))
+
+    def handle_charref(self, name):
+        if name[:1] in ("x", "X"):
+            codepoint = int(name[1:].lstrip(name[0]), 16)
+        else:
+            codepoint = int(name)
+
+        data = None
+        if codepoint < 256:
+            # Numbers below 256 are sometimes meant as Windows-1252 rather than Unicode.
+            try:
+                data = bytearray([codepoint]).decode('windows-1252')
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = unichr(codepoint)
+            except (ValueError, OverflowError):
+                pass
+        self.data.append(data or u"\N{REPLACEMENT CHARACTER}")
+
+    def handle_other(self, data):
+        # Comments, declarations and the like are rendered as text of their own.
+        self.flush()
+        self.data.append(data)
+        self.flush()
+
+    def handle_comment(self, data):
+        self.handle_other(data)
+
+    def handle_decl(self, data):
+        self.handle_other(data[len("DOCTYPE "):])
+
+    def unknown_decl(self, data):
+        self.handle_other(data[len("CDATA["):] if data.upper().startswith("CDATA[") else data)
+
+    def handle_pi(self, data):
+        self.handle_other(data)
+
+    def error(self, message):
+        # Carry on past anything too broken to parse, rather than failing the whole post.
+        pass
+
+
+class MarkdownParser:
+    """
+    Converts Markdown text into HTML or Evennia color codes.  Nothing is converted until it's
+    asked for, and each result is remembered, both on the instance and in a small module-wide
+    cache of recently seen text.
+    """
+
+    def __init__(self, original):
         if original is None:
             raise ValueError
 
-        text = original.replace("|/", "\n")
-        text = text.replace("%r", "\n")
-        text = text.replace("|-", "\t")
-        text = text.replace("%t", "\t")
-        text = text.replace("|_", " ")
-        text = text.replace("%b", " ")
-        self.original = strip_ansi(text)
-        self.html = markdown2.markdown(self.original)
-        self.text = None
+        self.source = original
+        self._recent = _remember(original)
 
-    def as_html(self):
-        return self.html
+    @property
+    def original(self):
+        """
+        The text with MUSH substitutions turned into whitespace and color codes stripped.
+        """
+        if "original" not in self._recent:
+            text = self.source.replace("|/", "\n")
+            text = text.replace("%r", "\n")
+            text = text.replace("|-", "\t")
+            text = text.replace("%t", "\t")
+            text = text.replace("|_", " ")
+            text = text.replace("%b", " ")
+            self._recent["original"] = strip_ansi(text)
 
-    def recursive_children(self, x):
-        if "childGenerator" in dir(x):
-            for child in x.childGenerator():
-                name = getattr(child, "name", None)
-                if name is not None:
-                    name = name.lower()
-                    self.tags.append(name)
-
-                if name == "ul":
-                    self.indent += 1
-                    if len(self.tags) >= 2 and self.tags[-2] == "li":
-                        self.text += "|/"
-                elif name == "ol":
-                    self.indent += 1
-                    self.counters.append(1)
-                    if len(self.tags) >= 2 and self.tags[-2] == "li":
-                        self.text += "|/"
-                elif name == "li":
-                    if len(self.tags) == 1 or not self.tags[-2] == "ol":
-                        self.text += "|/" + ("  " * self.indent) + "* "
-                    else:
-                        counter = self.counters[-1]
-                        self.text += "|/" + ("  " * self.indent) + "{}. ".format(counter)
-                        self.counters[-1] = counter + 1
-                elif name == "p":
-                    if len(self.tags) == 1 or (not self.tags[-2] == "blockquote" and not self.tags[-2] == "li"):
-                        self.text += "|/"
-                elif name == "pre":
-                    self.text += "|/"
-                elif name == "blockquote":
-                    self.text += "|/> "
-
-                self.recursive_children(child)
-
-                if name is not None:
-                    self.tags.pop()
-                    if name == "ul":
-                        self.indent -= 1
-                    elif name == "ol":
-                        self.indent -= 1
-                        self.counters.pop()
-                    elif name == "li":
-                        self.text += "|/"
-                    elif name == "p":
-                        if len(self.tags) == 0 or (not self.tags[-1] == "blockquote" and not self.tags[-1] == "li"):
-                            self.text += "|/"
-                    elif name == "pre":
-                        self.text += "|/"
-                    elif name == "blockquote":
-                        self.text += "|/"
-                    elif name == "a":
-                        href = child['href']
-                        if href:
-                            if self.text[-1] != ' ':
-                                self.text += " "
-                            self.text += "(" + href + ")"
+        return self._recent["original"]
 
-        else:
-            tag = self.tags[-1] if len(self.tags) > 0 else ""
-            uptag = self.tags[-2] if len(self.tags) > 1 else ""
-            if tag != "pre" and uptag != "pre":
-                x = x.replace("\n", " ")
-            if not x.isspace():
-                if tag == "h1":
-                    self.text += "|/|w" + x.upper() + "|n|/"
-                elif tag == "h2":
-                    self.text += "|/|w|u" + x + "|n|/"
-                elif tag in ["h3", "h4", "h5"]:
-                    self.text += "|/|w" + x + "|n|/"
-                elif tag == "strong":
-                    self.text += "|w" + x + "|n"
-                elif tag == "em":
-                    self.text += "|u" + x + "|n"
-                else:
-                    self.text += x
+    @property
+    def html(self):
+        if "html" not in self._recent:
+            self._recent["html"] = markdown2.markdown(self.original)
 
-    def as_mush(self):
+        return self._recent["html"]
 
-        if self.text is None:
-            self.text = ""
+    @property
+    def text(self):
+        if "text" not in self._recent:
+            self._recent["text"] = MushRenderer().render(self.html)
 
-            html = self.as_html()
-            soup = BeautifulSoup(html, "html.parser")
-            self.recursive_children(soup)
+        return self._recent["text"]
 
-            text = self.text.strip()
-            while text.rstrip().endswith("|/"):
-                text = text.rstrip()[:-2]
-            self.text = text + "|/"
+    def as_html(self):
+        return self.html
 
+    def as_mush(self):
         return self.text
@@ -1,6 +1,6 @@
 from django import template
 from django.utils.html import urlize
-from ..parser import MarkdownParser
+from .. import cache
 import re
 
 register = template.Library()
@@ -11,9 +11,7 @@ def markdown(value):
     if not value:
         return value
 
-    md = MarkdownParser(value)
-
-    return md.as_html()
+    return cache.as_html(value)
 
 
 @register.filter
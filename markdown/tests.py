@@ -0,0 +1,80 @@
+import io
+import json
+import os
+import threading
+
+from django.test import SimpleTestCase
+from mock import patch
+
+from markdown import parser
+from markdown.parser import MarkdownParser, MushRenderer
+
+# Markdown samples with the HTML markdown2 makes from them, and the MUSH text the original
+# BeautifulSoup-based renderer made from that HTML.
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), "golden.json")
+
+
+class TestMushRenderer(SimpleTestCase):
+
+    def test_golden_corpus(self):
+        with io.open(GOLDEN_PATH, encoding="utf-8") as f:
+            golden = json.load(f)
+
+        for case in golden:
+            self.assertEqual(MushRenderer().render(case["html"]), case["mush"], case["markdown"])
+
+    def test_malformed_html(self):
+        self.assertEqual(MushRenderer().render(u"<p>Unclosed <strong>bold</p> <em>x</b>"),
+                         u"|/Unclosed |wbold|n|/|ux|n|/")
+        self.assertEqual(MushRenderer().render(u"<p>A &amp; B<br></br>C&#147;</p>"), u"|/A & BC\u201c|/")
+
+    def test_parser(self):
+        parser = MarkdownParser(u"* one|/* two")
+        self.assertEqual(parser.as_mush(), u"|/  * one|/|/  * two|/")
+        self.assertEqual(parser.as_mush(), MushRenderer().render(parser.as_html()))
+
+
+class TestMarkdownParser(SimpleTestCase):
+
+    def setUp(self):
+        # Other tests (and rendering posts) fill the module-wide cache of recent texts.
+        parser._recent.clear()
+
+    def test_lazy(self):
+        with patch('markdown2.markdown', return_value=u"<p>lazy</p>") as markdown:
+            md = MarkdownParser(u"Lazy text that isn't used elsewhere")
+            self.assertFalse(markdown.called)
+            self.assertEqual(md.original, u"Lazy text that isn't used elsewhere")
+            self.assertFalse(markdown.called)
+
+            self.assertEqual(md.as_mush(), u"|/lazy|/")
+            self.assertEqual(md.as_html(), u"<p>lazy</p>")
+            self.assertEqual(markdown.call_count, 1)
+
+            # The same text again is remembered, even in a new parser.
+            self.assertEqual(MarkdownParser(u"Lazy text that isn't used elsewhere").as_mush(), u"|/lazy|/")
+            self.assertEqual(markdown.call_count, 1)
+
+    def test_recent_size(self):
+        with patch.object(parser, 'RECENT_SIZE', 3):
+            for i in range(5):
+                MarkdownParser(u"Text " + str(i)).as_html()
+            MarkdownParser(u"Text 2").as_html()
+
+            self.assertEqual(list(parser._recent), [u"Text 3", u"Text 4", u"Text 2"])
+
+    def test_recent_threads(self):
+        # Web pages render from worker threads while the reactor renders too.
+        def remember(start):
+            for i in range(500):
+                parser._remember(u"Text " + str((start + i) % 300))
+
+        with patch.object(parser, 'RECENT_SIZE', 50):
+            threads = [threading.Thread(target=remember, args=(n * 37,)) for n in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(len(parser._recent), 50)
+            self.assertEqual(len(list(parser._recent)), 50)
@@ -0,0 +1,210 @@
+"""
+A short-lived cache of board lock checks.
+
+Every bboard command and board page checks the read lock on every board, and often the post
+lock too, and lock checks can be costly.  Results are kept for ACCESS_TTL seconds (or the
+PAXBOARDS_ACCESS_TTL setting), per accessor, board and access type, for up to ACCESS_CACHE_SIZE
+accessors at a time.  A board's results are dropped as soon as the board is saved, which is how
+changed locks are stored.  An account or character's results are dropped whenever its tags
+(including its permissions) change, or it's saved with a change to one of its LOCK_FIELDS.
+
+"""
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models.signals import class_prepared, post_save, m2m_changed
+from evennia.accounts.models import AccountDB
+from evennia.objects.models import ObjectDB
+from paxboards.models import BoardDB
+
+ACCESS_TTL = 30
+
+# How many accessors to keep results for; past this, expired results are dropped, and if that
+# isn't enough, everything is.
+ACCESS_CACHE_SIZE = 1024
+
+# The fields of accounts and objects which lock checks depend on: whether an account is a
+# superuser, which account is puppeting an object, and names and typeclasses, which some lock
+# functions check.  Saves which only change other fields, such as a Character moving, keep
+# their results.
+LOCK_FIELDS = frozenset(('is_superuser', 'username', 'db_account', 'db_key', 'db_typeclass_path'))
+
+
+class AccessCache(object):
+    """
+    Keeps the results of board lock checks, and counts how often they're reused.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.generations = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def accessor_key(accessor):
+        """
+        Gets the key lock results are kept under for something checking a lock.
+
+        Args:
+            accessor: The account, character or web user checking the lock.
+
+        Returns:
+            A hashable key, or None if the accessor can't be cached (such as an anonymous web
+            user).
+
+        """
+        pk = getattr(accessor, 'pk', None)
+        if pk is None:
+            return None
+
+        dbclass = getattr(accessor, '__dbclass__', None) or type(accessor)
+        return dbclass.__name__, pk
+
+    def check(self, accessor, board, access_type, default, check_lock):
+        """
+        Gets the result of a lock check, running it only if there isn't a recent result.
+
+        Args:
+            accessor: The account, character or web user checking the lock.
+            board (BoardDB): The board whose lock is being checked.
+            access_type (str): The lock type, such as 'read' or 'post'.
+            default (bool): The result if the board has no lock of that type.
+            check_lock (callable): Runs the lock check for real.
+
+        Returns:
+            True if the accessor passes the lock.
+
+        """
+        owner = self.accessor_key(accessor)
+        if owner is None or board.pk is None:
+            return check_lock()
+
+        now = time.time()
+        key = (board.pk, access_type, default)
+        generation = self.generations.get(board.pk, 0)
+        results = self.entries.get(owner)
+        if results is None:
+            if len(self.entries) >= ACCESS_CACHE_SIZE:
+                self.prune(now)
+            results = self.entries[owner] = {}
+
+        entry = results.get(key)
+        if entry and entry[0] > now and entry[1] == generation:
+            self.hits += 1
+            return entry[2]
+
+        self.misses += 1
+        result = check_lock()
+        results[key] = (now + getattr(settings, 'PAXBOARDS_ACCESS_TTL', ACCESS_TTL), generation, result)
+        return result
+
+    def prune(self, now):
+        """
+        Drops expired results, and if the cache is still full, every result.
+
+        Args:
+            now (float): The current time.
+
+        Returns:
+            None
+
+        """
+        for owner, results in list(self.entries.items()):
+            for key, entry in list(results.items()):
+                if entry[0] <= now:
+                    del results[key]
+            if not results:
+                del self.entries[owner]
+
+        if len(self.entries) >= ACCESS_CACHE_SIZE:
+            self.entries.clear()
+
+    def invalidate_board(self, board):
+        """
+        Forgets every lock result for a board, such as when its locks change.
+
+        Args:
+            board (BoardDB): The board.
+
+        Returns:
+            None
+
+        """
+        self.generations[board.pk] = self.generations.get(board.pk, 0) + 1
+
+    def invalidate_accessor(self, accessor):
+        """
+        Forgets every lock result for an account or character, such as when its permissions
+        change.
+
+        Args:
+            accessor: The account or character.
+
+        Returns:
+            None
+
+        """
+        self.entries.pop(self.accessor_key(accessor), None)
+
+    def clear(self):
+        """
+        Forgets every lock result.
+
+        Returns:
+            None
+
+        """
+        self.entries.clear()
+        self.generations.clear()
+
+
+ACCESS_CACHE = AccessCache()
+
+
+def saved(sender, instance, update_fields=None, **kwargs):
+    if isinstance(instance, BoardDB):
+        ACCESS_CACHE.invalidate_board(instance)
+    elif update_fields is None or not LOCK_FIELDS.isdisjoint(update_fields):
+        ACCESS_CACHE.invalidate_accessor(instance)
+
+
+def tags_changed(sender, instance, action, reverse, **kwargs):
+    if not action.startswith("post_"):
+        return
+
+    if reverse:
+        # Tags were changed from the tag's side, so we don't know quite whose; start over.
+        ACCESS_CACHE.clear()
+    else:
+        ACCESS_CACHE.invalidate_accessor(instance)
+
+
+def watch(model):
+    """
+    Listens for saves of a model, if saving it can change the outcome of lock checks.  Django
+    reports saves under the class that was saved, so every typeclass has to be listened to
+    separately, not just the database models they're built on.
+    """
+    if issubclass(model, (BoardDB, AccountDB, ObjectDB)):
+        post_save.connect(saved, sender=model,
+                          dispatch_uid="paxboards.access.saved." + model.__module__ + "." + model.__name__)
+
+
+def model_prepared(sender, **kwargs):
+    watch(sender)
+
+
+# Typeclasses can be loaded at any time, so watch for those loaded after this module as well.
+for app_models in apps.all_models.values():
+    for model in app_models.values():
+        watch(model)
+
+class_prepared.connect(model_prepared, dispatch_uid="paxboards.access.model_prepared")
+
+# Only listen to the tag tables; a listener on every table would stop Django deleting rows from
+# the others (such as the read posts of read markers) in a single query.
+for model in (AccountDB, ObjectDB):
+    m2m_changed.connect(tags_changed, sender=model.db_tags.through,
+                        dispatch_uid="paxboards.access.tags_changed." + model.__name__)
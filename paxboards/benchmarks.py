@@ -0,0 +1,218 @@
+"""
+Benchmarks for paxboards.
+
+These are not part of the normal test run, since seeding large boards takes a while.  To run
+them, use:
+
+    evennia test paxboards.benchmarks
+
+The bboard command benchmark writes its results as JSON, so that runs can be compared to catch
+regressions.  How much it seeds and where it writes can be changed with the PAXBOARDS_BENCHMARK
+setting, a dictionary with any of the keys in BENCHMARK_DEFAULTS.
+
+"""
+from __future__ import print_function
+
+import json
+import random
+import resource
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from evennia.commands.default.tests import CommandTest
+from evennia.utils import create
+from evennia.utils.test_resources import EvenniaTest
+
+from paxboards.board_commands import BoardCmd
+from paxboards.boards import DefaultBoard
+from paxboards.models import Post, ReadMarker
+from paxboards.pipeline import PIPELINE
+
+BOARD_SIZES = (100, 1000, 10000)
+REPEATS = 20
+
+BENCHMARK_DEFAULTS = {
+    'boards': 5,
+    'posts': 1000,
+    'readers': 20,
+    'subscribers': 10,
+    'repeats': 5,
+    'seed': 1066,
+    'output': 'paxboards-benchmark.json',
+}
+
+# Each bboard switch to time, as (name, arguments).  Board 0 is the one everyone reads.
+COMMAND_CASES = (
+    ("read list", ""),
+    ("read board", "/read Bench0"),
+    ("read page", "/page Bench0={middle}"),
+    ("read post", "/read Bench0/{middle}"),
+    ("thread", "/thread Bench0/{middle}"),
+    ("scan", "/scan"),
+    ("new", "/new Bench0"),
+    ("search", "/search Bench0=\"Post 42\""),
+    ("catchup", "/catchup Bench0"),
+    ("post", "/post Bench0/Benchmark=A new post, made while benchmarking."),
+    ("reply", "/reply Bench0/1=A reply, made while benchmarking."),
+)
+
+
+def seed_posts(board, count):
+    """
+    Quickly fills a board with posts, bypassing create_post.
+
+    Args:
+        board (DefaultBoard): The board to fill.
+        count (int): How many posts to add.
+
+    Returns:
+        None
+
+    """
+    start = timezone.now() - timedelta(minutes=count)
+    Post.objects.bulk_create([Post(db_board=board, db_poster_name="Benchmark", db_subject="Post " + str(i),
+                                   db_text="Benchmark post " + str(i), db_pinned=False,
+                                   db_date_created=start + timedelta(minutes=i),
+                                   db_last_reply_at=start + timedelta(minutes=i))
+                              for i in range(count)], batch_size=500)
+
+
+def seed_readers(boards, readers, rng):
+    """
+    Gives each reader a read marker partway through each board, as if they'd been reading
+    along and fallen behind by differing amounts.
+
+    Args:
+        boards (list): The boards to mark.
+        readers (list): The accounts to mark them for.
+        rng (random.Random): The random.Random to choose how far each reader got.
+
+    Returns:
+        None
+
+    """
+    markers = []
+    for board in boards:
+        dates = list(board.posts().values_list('db_date_created', flat=True))
+        for reader in readers:
+            markers.append(ReadMarker(db_account=reader, db_board=board,
+                                      db_read_until=rng.choice(dates) if dates else None))
+
+    ReadMarker.objects.bulk_create(markers, batch_size=500)
+
+
+def measure(func, repeats=REPEATS):
+    """
+    Runs a function several times, tracking the queries it makes and how long it takes.
+
+    Args:
+        func (callable): The function to run.
+        repeats (int): How many times to run it.
+
+    Returns:
+        A tuple of (queries per call, average seconds per call).
+
+    """
+    with CaptureQueriesContext(connection) as context:
+        start = time.time()
+        for _ in range(repeats):
+            func()
+        elapsed = time.time() - start
+
+    return len(context.captured_queries) // repeats, elapsed / repeats
+
+
+def peak_memory():
+    """
+    Gets the most memory this process has used so far.
+
+    Returns:
+        The peak resident set size, in kilobytes (bytes, on macOS).
+
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class BenchmarkPostRead(EvenniaTest):
+
+    def test_read_latency(self):
+        results = []
+        for size in BOARD_SIZES:
+            board = DefaultBoard(db_key="Benchmark " + str(size))
+            board.save()
+            seed_posts(board, size)
+
+            post = board.posts().last()
+            queries, elapsed = measure(lambda: post.display_post(self.account))
+            results.append((size, queries, elapsed))
+
+        print()
+        for size, queries, elapsed in results:
+            print("read post, %6d posts: %3d queries, %8.2f ms" % (size, queries, elapsed * 1000))
+
+        # Reading a post should cost the same number of queries however large the board is.
+        self.assertEqual(len(set(queries for _, queries, _ in results)), 1)
+
+
+class BenchmarkBoardCommand(CommandTest):
+
+    def seed(self, config):
+        rng = random.Random(config['seed'])
+
+        readers = [self.account] + [create.create_account("Reader" + str(i), "reader%d@example.com" % i,
+                                                          "benchmark")
+                                    for i in range(config['readers'] - 1)]
+
+        boards = []
+        for i in range(config['boards']):
+            board = DefaultBoard(db_key="Bench" + str(i))
+            board.save()
+            seed_posts(board, config['posts'])
+            board.db_subscriptions.add(*readers[:config['subscribers']])
+            boards.append(board)
+
+        seed_readers(boards, readers, rng)
+
+    def test_board_commands(self):
+        config = dict(BENCHMARK_DEFAULTS)
+        config.update(getattr(settings, 'PAXBOARDS_BENCHMARK', None) or {})
+
+        self.seed(config)
+
+        results = []
+        for name, args in COMMAND_CASES:
+            args = args.format(middle=config['posts'] // 2)
+            before = peak_memory()
+            queries, elapsed = measure(lambda: self.call(BoardCmd(), args), repeats=config['repeats'])
+            # Work queued by posting happens after the command, on later passes of the reactor.
+            PIPELINE.drain()
+            results.append({
+                'switch': name,
+                'args': args,
+                'queries': queries,
+                'ms': round(elapsed * 1000, 3),
+                'peak_memory_growth_kb': peak_memory() - before,
+            })
+
+        report = {
+            'date': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'config': config,
+            'results': results,
+            'pipeline': PIPELINE.report(),
+        }
+        with open(config['output'], 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+        print()
+        for result in results:
+            print("%-12s %4d queries, %8.2f ms, peak memory +%d KB" %
+                  (result['switch'], result['queries'], result['ms'], result['peak_memory_growth_kb']))
+        for name, timing in PIPELINE.report().items():
+            print("pipeline %-8s %4d runs, %8.2f ms average, %8.2f ms slowest" %
+                  (name, timing['runs'], timing['average_ms'], timing['slowest_ms']))
+        print("Results written to " + config['output'])
@@ -8,32 +8,19 @@ from commands.command import PaxCommand
 
 from board_utils import *
 from boards import DefaultBoard
-from models import Post
-
-
-def is_positive_int(string):
-    """
-    Tests whether the given string is a plain, positive integer.
-
-    Args:
-        string (str): A string to test.
-
-    Returns:
-        True if the string is an integer greater than 0, False if not.
-    """
-    try:
-        test = int(string)
-        if test > 0:
-            return True
-        return False
-    except ValueError:
-        return False
+from managers import is_positive_int
+from access import ACCESS_CACHE
+from pipeline import PIPELINE
+from models import Post, ReadMarker
+from markdown import cache as markdown
+from utils.text import display_width
 
 
 class BoardAdminCmd(PaxCommand):
     """
     bbadmin/create <name>
     bbadmin/lock <board>[=lock]
+    bbadmin/pipeline
 
     The first form of the command will create a new board.  The name must be unique,
     and cannot be solely an integer string.
@@ -49,6 +36,10 @@ class BoardAdminCmd(PaxCommand):
 
     Wizards and Immortals have all permissions by default.
 
+    The third form of the command shows how long each stage of the work done after
+    a post is made (numbering it, announcing it and rendering its text) has taken,
+    and how many posts are waiting on it.
+
     """
     key = "bbadmin"
     aliases = ["@bbadmin", "forumadmin", "@forumadmin"]
@@ -100,6 +91,8 @@ class BoardAdminCmd(PaxCommand):
             except LockException, err:
                 self.notify(err)
                 return
+            finally:
+                ACCESS_CACHE.invalidate_board(board)
 
             self.notify("Lock(s) applied.")
             string = "Current locks on %s: %s" % (board.name, board.locks)
@@ -132,6 +125,7 @@ class BoardAdminCmd(PaxCommand):
                 self.notify("Board expiry set to " + str(board.db_expiry_duration) + " days.")
 
             board.save()
+            ReadMarker.objects.forget_unread_counts(board)
             return
 
         if "maxposts" in self.switches:
@@ -160,15 +154,112 @@ class BoardAdminCmd(PaxCommand):
                 self.notify("Board post maximum set to " + str(board.db_expiry_maxposts) + " posts.")
 
             board.save()
+            ReadMarker.objects.forget_unread_counts(board)
+            return
+
+        if "pipeline" in self.switches:
+            note = self.get_notification(border=True, header="Post Pipeline")
+            table = evtable.EvTable(border="header", width=note.width)
+            table.add_column("|wStage|n")
+            table.add_column("|wRuns|n", width=8)
+            table.add_column("|wFailed|n", width=8)
+            table.add_column("|wAvg ms|n", width=10)
+            table.add_column("|wMax ms|n", width=10)
+            for name, timing in PIPELINE.report().items():
+                table.add_row(name, timing['runs'], timing['failures'], "%.2f" % timing['average_ms'],
+                              "%.2f" % timing['slowest_ms'])
+
+            note.add_line(str(table))
+            note.add_line("Posts waiting: " + str(PIPELINE.backlog))
+            note.send(self.caller)
             return
 
         self.notify("Unknown switch.  Please see |555help " + self.cmdstring + "|n for help.")
 
 
+class BoardContext(object):
+    """
+    The boards a player can see, worked out at most once per command.  Only what's asked for is
+    loaded: finding a board by name or number only checks which boards are readable, while the
+    unread and total counts are only added when a listing needs them.
+    """
+
+    def __init__(self, caller):
+        self.caller = caller
+        self._readable = None
+        self._summarized = False
+        self._subscribed = None
+
+    @property
+    def readable(self):
+        """
+        The boards the player can read, in listing order, without any counts.
+        """
+        if self._readable is None:
+            self._readable = DefaultBoard.objects.get_readable_boards(self.caller)
+
+        return self._readable
+
+    @property
+    def summarized(self):
+        """
+        The boards the player can read, with unread_count, total_count and last_post set.
+        """
+        if not self._summarized:
+            DefaultBoard.objects.summarize_boards(self.readable, self.caller)
+            self._summarized = True
+
+        return self._readable
+
+    def is_subscribed(self, board):
+        """
+        Checks if the player is subscribed to a board, loading all their subscriptions at once.
+
+        Args:
+            board (DefaultBoard): The board to check.
+
+        Returns:
+            True if the player is subscribed.
+
+        """
+        if self._subscribed is None:
+            self._subscribed = set(DefaultBoard.objects.filter(db_subscriptions=self.caller)
+                                   .values_list('pk', flat=True))
+
+        return board.pk in self._subscribed
+
+    def find(self, key):
+        """
+        Finds a single readable board by its number in the listing, or by the start of its name.
+
+        Args:
+            key (str): A board number, or the start of a board name.
+
+        Returns:
+            A DefaultBoard object, or None if there isn't exactly one match.
+
+        """
+        boards = self.readable
+        if is_positive_int(key):
+            boardnum = int(key)
+            if 0 < boardnum <= len(boards):
+                return boards[boardnum - 1]
+
+            return None
+
+        key = key.lower()
+        matches = [b for b in boards if b.db_key.lower().startswith(key)]
+        if len(matches) == 1:
+            return matches[0]
+
+        return None
+
+
 class BoardCmd(PaxCommand):
     """
     bboard [board[/post]]
     bboard/read [board[/post]]
+    bboard/page <board>=<post>
     bboard/post <board>/<subject>=<post>
     bboard/sub <board>
     bboard/unsub <board>
@@ -184,7 +275,11 @@ class BoardCmd(PaxCommand):
     The first and second forms of this command will read the bboards.  If no
     parameters are provided, it list all available bboards.  If a single
     parameter - the board - is provided, it will list the posts on that
-    board.  If two are provided, it will read the specific post.
+    board.  If two are provided, it will read the specific post.  Busy
+    boards are listed a page at a time, newest page first, with pages sized
+    to your display height (see 'help display'); bboard/page will show the
+    page of posts leading up to the given post, and the footer of each page
+    says how to reach the next one.
 
     The third form will make a post to a given bboard.  Posts can be
     formatted using Markdown; _emphasis_, **bold**, bulleted lists, and
@@ -202,7 +297,9 @@ class BoardCmd(PaxCommand):
     will read the next unread post on the given board, or globally, and the
     ninth will mark all posts read on the given board (or 'all').
 
-    The tenth will search bboards for posts containing a given term.
+    The tenth will search bboards for posts containing all the given terms.
+    A "quoted phrase" matches exactly, and a term can be limited to one
+    field with subject:, text: or poster:, as in 'poster:Pax "game night"'.
 
     The eleventh will reply to an existing post, creating a thread, while
     the twelfth will show all posts in a given thread.
@@ -240,7 +337,7 @@ class BoardCmd(PaxCommand):
                 self.notify("The post identifier '" + readargs[1] + "' must be a positive integer!")
                 return None
 
-        board = DefaultBoard.objects.get_visible_board(self.account, boardname)
+        board = self.boards.find(boardname)
         if not board:
             self.notify("Unable to find a board matching '" + string + "'!")
             return None
@@ -248,22 +345,89 @@ class BoardCmd(PaxCommand):
         if len(readargs) == 1:
             return {"board": board, "post": None, "postnum": 0}
 
-        posts = board.posts(self.account)
+        posts = list(board.posts(self.account)[postnum - 1:postnum]) if postnum > 0 else []
 
-        if not (0 < postnum <= len(posts)):
+        if not posts:
             self.notify("There's no post by that number.")
             return
 
-        post = posts[postnum - 1]
+        post = posts[0]
 
         return {"board": board, "post": post, "postnum": postnum}
 
+    def show_posts(self, board, before=None):
+        """
+        Lists a page of posts on a board.  Pages are sized to fit the caller's display height,
+        and are found from their neighbouring post rather than by offset, so only one page of
+        posts is ever loaded however long the board is.
+
+        Args:
+            board: The board whose posts should be listed.
+            before: The number of the post following the page, or None for the newest page.
+
+        """
+        # The total comes from the board's summary, rather than a count of its own.
+        posts = board.posts(player=self.account)
+        total = DefaultBoard.objects.summarize_boards([board], self.account)[0].total_count
+        if not total:
+            self.notify("No posts on " + board.name)
+            return
+
+        if before is None:
+            before = total + 1
+            newest_first = posts.reverse()
+        else:
+            following = list(posts[before - 1:before]) if before > 0 else []
+            if not following:
+                self.notify("There's no post by that number.")
+                return
+            newest_first = posts.before(following[0]).reverse()
+
+        page_size = posts_per_page(self.get_height())
+        page = list(newest_first[:page_size + 1])
+        older = len(page) > page_size
+        page = page[:page_size]
+        page.reverse()
+
+        first_width = display_width(self.lhs) + 6
+        first = before - len(page)
+
+        links = []
+        if older:
+            links.append("Older: bboard/page " + self.lhs + "=" + str(first))
+        if before <= total:
+            if before + page_size > total:
+                links.append("Newer: bboard " + self.lhs)
+            else:
+                links.append("Newer: bboard/page " + self.lhs + "=" + str(before + page_size))
+
+        note = self.get_notification(border=True, header="Posts", footer="  ".join(links) or None)
+        table = evtable.EvTable(border="header", width=note.width)
+        table.add_column(width=first_width)
+        table.add_column("|wPoster|n", width=20)
+        table.add_column("|wSubject|n")
+        table.add_column("|wDate|n", width=20)
+        counter = first
+        for post in page:
+            unreadstring = "  "
+            if post.is_unread:
+                unreadstring = "|555*|n "
+
+            datestring = datetime_to_date(post.db_date_created)
+
+            table.add_row(unreadstring + self.lhs + "/" + str(counter), post.db_poster_name,
+                          post.subject, datestring)
+            counter += 1
+
+        note.add_line(str(table))
+        note.send(self.caller)
+
     # This is overly long, and could potentially use a refactor to split the switches out
     # into their own functions.
     def func(self):
         caller = self.account
 
-        boards = DefaultBoard.objects.get_all_visible_boards(caller)
+        self.boards = BoardContext(caller)
         shortcut = False
         if self.cmdstring in ["@bbread", "@bbnew"]:
             shortcut = True
@@ -279,11 +443,11 @@ class BoardCmd(PaxCommand):
                 table.add_column("|wTotal|n", width=10)
                 table.add_column("|wSub'd|n", width=10)
                 counter = 0
-                for board in boards:
+                for board in self.boards.summarized:
                     counter += 1
 
                     subbed = " "
-                    if board.subscribers().filter(pk=caller.pk).exists():
+                    if self.boards.is_subscribed(board):
                         subbed = "Yes"
 
                     table.add_row(counter, board.name, board.unread_count, board.total_count, subbed)
@@ -300,45 +464,36 @@ class BoardCmd(PaxCommand):
                 post = result["post"]
 
                 if not post:
-                    posts = board.posts(player=caller)
-                    if not posts:
-                        self.notify("No posts on " + board.name)
-                        return
-
-                    first_width = len(self.lhs) + 6
-
-                    note = self.get_notification(border=True, header="Posts")
-                    table = evtable.EvTable(border="header", width=note.width)
-                    table.add_column(width=first_width)
-                    table.add_column("|wPoster|n", width=20)
-                    table.add_column("|wSubject|n")
-                    table.add_column("|wDate|n", width=20)
-                    counter = 0
-                    for post in posts:
-                        counter += 1
-
-                        unreadstring = "  "
-                        if post.is_unread:
-                            unreadstring = "|555*|n "
-
-                        datestring = datetime_to_date(post.db_date_created)
-
-                        table.add_row(unreadstring + self.lhs + "/" + str(counter), post.db_poster_name,
-                                      post.subject, datestring)
-
-                    note.add_line(str(table))
-                    note.send(self.caller)
+                    self.show_posts(board)
                 else:
                     if "thread" in self.switches:
                         while post.db_parent:
                             post = post.db_parent
 
                     post.display_post(caller, show_replies=("thread" in self.switches))
-                    post.db_readers.add(caller)
-                    post.save()
+                    post.mark_read(caller, True)
 
                     return
 
+        if "page" in self.switches:
+            if not self.lhs or not self.rhs:
+                self.notify("You must provide a board and a post number.")
+                return
+
+            board = self.boards.find(self.lhs)
+            if not board:
+                self.notify("Unable to find a unique board matching '" + self.lhs + "'")
+                return
+
+            try:
+                before = int(self.rhs)
+            except ValueError:
+                self.notify("The post number '" + self.rhs + "' must be a positive integer!")
+                return
+
+            self.show_posts(board, before)
+            return
+
         if "pin" in self.switches or "unpin" in self.switches:
             result = self.resolve_id(self.lhs)
             if not result:
@@ -358,6 +513,9 @@ class BoardCmd(PaxCommand):
             pinvalue = "pin" in self.switches
             post.db_pinned = pinvalue
             post.save()
+            # Pinned posts count towards a post limit, so pinning can change which posts are visible.
+            if board.db_expiry_maxposts:
+                ReadMarker.objects.forget_unread_counts(board)
 
             self.notify("Pinned.") if pinvalue else self.notify("Unpinned.")
             return
@@ -372,11 +530,11 @@ class BoardCmd(PaxCommand):
             table.add_column("|wSub'd|n", width=7)
             counter = 0
             has_unread = False
-            for board in boards:
+            for board in self.boards.summarized:
                 counter += 1
 
                 subbed = " "
-                if board.subscribers().filter(pk=caller.pk).exists():
+                if self.boards.is_subscribed(board):
                     subbed = "Yes"
 
                 if board.unread_count > 0:
@@ -392,9 +550,9 @@ class BoardCmd(PaxCommand):
 
         if "new" in self.switches or self.cmdstring == "@bbnew":
             if not self.lhs:
-                for b in boards:
+                for b in self.boards.readable:
 
-                    if b.subscribers().filter(pk=caller.pk).exists():
+                    if self.boards.is_subscribed(b):
                         posts = b.posts(caller)
                         for p in posts:
                             if p.is_unread:
@@ -429,9 +587,7 @@ class BoardCmd(PaxCommand):
                 return
 
             if self.lhs == "all":
-                boards = DefaultBoard.objects.get_all_visible_boards(caller)
-                for b in boards:
-                    b.mark_all_read(caller)
+                DefaultBoard.objects.mark_all_read(caller, self.boards.readable)
 
                 self.notify("All boards marked read.")
                 return
@@ -462,7 +618,7 @@ class BoardCmd(PaxCommand):
                 self.notify("It wouldn't do much good to make an empty post, would it?")
                 return
 
-            board = DefaultBoard.objects.get_visible_board(caller, boardname)
+            board = self.boards.find(boardname)
             if not board:
                 self.notify("Unable to find a unique board matching '" + self.lhs + "'")
                 return
@@ -553,7 +709,7 @@ class BoardCmd(PaxCommand):
                 self.notify("You must provide a bboard to " + ("subscribe" if sub else "unsubscribe") + "to.")
                 return
 
-            board = DefaultBoard.objects.get_visible_board(caller, self.lhs)
+            board = self.boards.find(self.lhs)
             if not board:
                 self.notify("Unable to find a unique board matching '" + self.lhs + "'")
                 return
@@ -582,25 +738,26 @@ class BoardCmd(PaxCommand):
                 boardname = readargs[0]
 
             if boardname:
-                board = DefaultBoard.objects.get_visible_board(caller, boardname)
+                board = self.boards.find(boardname)
                 if not board:
                     self.notify("Unable to find a unique board matching '" + boardname + "'")
                     return
 
-            posts = Post.objects.search(searchterm, board)
+            boards = [board] if board else self.boards.readable
+            posts = list(Post.objects.search(searchterm, boards=boards).with_positions(boards))
             if len(posts) == 0:
                 self.notify("No posts matching search term.")
                 return
 
             note = self.get_notification(border=True, header="Search Results")
             table = evtable.EvTable(border="header", width=note.width)
-            first_width = len(boardname) + 6 if boardname else 25
+            first_width = display_width(boardname) + 6 if boardname else 25
             table.add_column(width=first_width)
             table.add_column("|wPoster|n")
             table.add_column("|wSubject|n")
             table.add_column("|wDate|n", width=20)
             for post in posts:
-                postnum = post.post_num
+                postnum = post.position
                 if postnum:
                     if boardname:
                         postid = boardname + "/" + str(postnum)
@@ -638,6 +795,7 @@ class BoardCmd(PaxCommand):
 
             post.db_text = self.rhs
             post.save()
+            markdown.invalidate(post.render_key)
             self.notify("Post updated.")
             return
 
@@ -659,13 +817,7 @@ class BoardCmd(PaxCommand):
                 self.notify("You can't delete that post!")
                 return
 
-            # TODO: Should we delete this or just unlink it?
-            replies = Post.objects.filter(db_parent=post)
-            for r in replies:
-                r.db_parent = post.db_parent
-                r.save()
-
-            post.delete()
+            result["board"].delete_post(post)
             self.notify("Post deleted.")
             return
 
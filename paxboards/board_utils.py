@@ -10,6 +10,11 @@ def is_int(string):
         return False
 
 
+def posts_per_page(height):
+    # Leave room for the borders, the column headers and the prompt.
+    return max(int(height) - 6, 5)
+
+
 def localize_datetime(timestamp, tz=None):
     if tz is not None and isinstance(tz, basestring):
         tz = pytz.timezone(tz)
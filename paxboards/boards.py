@@ -1,10 +1,13 @@
 from evennia.typeclasses.models import TypeclassBase
-from paxboards.models import Post, BoardDB
+from paxboards.models import Post, BoardDB, ReadMarker
 from paxboards.managers import BoardManager
+from paxboards.access import ACCESS_CACHE
+from paxboards.pipeline import PIPELINE
 from future.utils import with_metaclass
 from server.conf import settings
 from django.utils import timezone
 from utils import notifications
+from markdown import cache as markdown
 
 
 class DefaultBoard(with_metaclass(TypeclassBase, BoardDB)):
@@ -30,6 +33,29 @@ class DefaultBoard(with_metaclass(TypeclassBase, BoardDB)):
     def at_board_creation(self):
         pass
 
+    def access(self, accessing_obj, access_type='read', default=False, no_superuser_bypass=False, **kwargs):
+        """
+        Checks a lock on this board, reusing the result of a recent identical check.
+
+        Args:
+            accessing_obj: The account, character or web user to check.
+            access_type (str): The lock type, such as 'read' or 'post'.
+            default (bool): The result if the board has no lock of that type.
+            no_superuser_bypass (bool): If True, superusers are checked like anyone else.
+
+        Returns:
+            True if the lock is passed.
+
+        """
+        def check_lock():
+            return super(DefaultBoard, self).access(accessing_obj, access_type=access_type, default=default,
+                                                    no_superuser_bypass=no_superuser_bypass, **kwargs)
+
+        if no_superuser_bypass or kwargs:
+            return check_lock()
+
+        return ACCESS_CACHE.check(accessing_obj, self, access_type, default, check_lock)
+
     def posts(self, player=None):
         """
         Convenience function, pulls all the posts for a given player's viewpoint.
@@ -98,12 +124,7 @@ class DefaultBoard(with_metaclass(TypeclassBase, BoardDB)):
         if not self.access(caller, access_type="read", default=True):
             return
 
-        posts = self.posts(caller)
-        for p in posts:
-            if p.is_unread:
-                p.mark_read(caller, True)
-
-        return
+        type(self).objects.mark_all_read(caller, [self])
 
     def is_unread(self):
         if hasattr(self, 'unread_count'):
@@ -114,7 +135,8 @@ class DefaultBoard(with_metaclass(TypeclassBase, BoardDB)):
     def create_post(self, subject, text, author_name=settings.SERVERNAME, author_player=None, author_object=None,
                     parent=None):
         """
-        Creates a new post on the given board.
+        Creates a new post on the given board.  The post is saved straight away; numbering it,
+        announcing it to subscribers and rendering its text are queued in paxboards.pipeline.
 
         Args:
             subject (string): The subject line for the post. Required.
@@ -137,36 +159,66 @@ class DefaultBoard(with_metaclass(TypeclassBase, BoardDB)):
         if not text or len(text) == 0:
             return False
 
+        now = timezone.now()
         p = Post(db_poster_player=author_player,
                  db_poster_object=author_object,
-                 db_date_created=timezone.now(),
+                 db_date_created=now,
                  db_subject=subject,
                  db_board=self,
                  db_text=text,
                  db_poster_name=author_name,
                  db_pinned=False,
-                 db_parent=parent)
+                 db_parent=parent,
+                 db_last_reply_at=now,
+                 db_last_reply_poster=author_name)
         p.save()
 
+        if parent:
+            thread = parent
+            while thread.db_parent:
+                thread = thread.db_parent
+            thread.add_reply(p)
+
+        # The post is added to the unread counts by the pipeline, once it's queued below.
+        ReadMarker.objects.uncounted[p.id] = self.id
+
         # If we are a player, mark our own post read.
         if author_player:
-            p.db_readers.add(author_player)
+            p.mark_read(author_player, True)
 
-        p.save()
+        PIPELINE.submit(p)
+
+        return p
+
+    def delete_post(self, post):
+        """
+        Deletes a post from this board.  Any replies to it are moved up to its parent, or become
+        threads of their own, and the thread summaries are updated to match.
+
+        Args:
+            post (Post): The post to delete.
 
-        postnum = p.post_num or None
+        Returns:
+            None
 
-        # Give up
-        if not postnum:
-            return p
+        """
+        parent = post.db_parent
 
-        announcement = "New post by |555" + p.db_poster_name + ":|n (" + self.name + "/" + \
-                       str(postnum) + "): |555" + p.db_subject + "|n"
+        # TODO: Should we delete this or just unlink it?
+        replies = list(Post.objects.filter(db_parent=post))
+        for r in replies:
+            r.db_parent = parent
+            r.save()
 
-        subs = self.subscribers()
-        notifications.Notification.send_as_notification(announcement, list=subs, notification_type="board")
+        markdown.invalidate(post.render_key)
+        post.delete()
+        ReadMarker.objects.forget_unread_counts(self)
 
-        return p
+        if parent:
+            parent.update_replies()
+        else:
+            for r in replies:
+                r.update_replies()
 
 
 notifications.Notification.add_type("board", "New post announcements from the bboard system.  Ignore this to turn off "
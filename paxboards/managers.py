@@ -1,10 +1,14 @@
 from __future__ import print_function
 
-from django.db import models
-from django.db.models import Q
-from datetime import datetime
+from django.db import models, transaction
+from django.db.models import F, Q, Case, When, Value, BooleanField, DateTimeField, IntegerField, Count, Sum, \
+    OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from datetime import datetime, timedelta
 from evennia.typeclasses.managers import (TypedObjectManager, TypeclassManager)
 from evennia.utils.idmapper.manager import SharedMemoryManager
+from search import get_backend
 
 _GA = object.__getattribute__
 _AccountDB = None
@@ -12,6 +16,10 @@ _ObjectDB = None
 _BoardDB = None
 _SESSIONS = None
 
+# Bounds used in place of 'no limit' when comparing post dates in the database.
+EARLIEST_DATE = datetime(1970, 1, 1, tzinfo=timezone.utc)
+LATEST_DATE = datetime(9999, 12, 31, tzinfo=timezone.utc)
+
 
 def sort_date(post):
     result_time = 0
@@ -46,6 +54,31 @@ def is_positive_int(string):
         return False
 
 
+def read_filter(player, date_field='db_date_created', post_field='pk'):
+    """
+    Builds a filter matching the posts the given player has read.  A post is read if it is older
+    than the player's read marker for its board, or was read out of order; both are checked with
+    subqueries, rather than a query per post.
+
+    Args:
+        player (AccountDB): The player whose read status should be used.
+        date_field (str): The field holding the date of the post to check.
+        post_field (str): The field holding the post to check.
+
+    Returns:
+        A Q object.
+
+    """
+    from models import ReadMarker
+
+    read_until = ReadMarker.objects.filter(db_account=player, db_board=OuterRef('db_board')) \
+        .values('db_read_until')[:1]
+    read_posts = ReadMarker.db_read_posts.through.objects.filter(readmarker__db_account=player) \
+        .values('post_id')
+
+    return Q(**{date_field + '__lte': Subquery(read_until)}) | Q(**{post_field + '__in': read_posts})
+
+
 class PostQuerySet(models.query.QuerySet):
 
     def by_board_all(self, board):
@@ -61,6 +94,42 @@ class PostQuerySet(models.query.QuerySet):
         """
         return self.filter(db_board=board)
 
+    def visible_filter(self, board):
+        """
+        Builds the filter matching the active posts on a board, honoring expiry limits.  This
+        doesn't run any queries itself, so filters for several boards can be combined.
+
+        Args:
+            board (Board): The BoardDB object to use.
+
+        Returns:
+            A Q object.
+
+        """
+        visible = Q(db_board=board)
+        if board.db_expiry_duration:
+            oldest = timezone.now() - timedelta(days=board.db_expiry_duration)
+            visible &= Q(db_date_created__gte=oldest) | Q(db_pinned=True)
+
+        # Once a board is over its post limit, the oldest unpinned posts drop off.  Pinned posts
+        # sort first and count towards the limit; the last post that fits is the one at the limit's
+        # offset in newest-first order, and if that's a pinned post, no unpinned posts fit at all.
+        if board.db_expiry_maxposts and (board.db_expiry_maxposts > 0):
+            offset = board.db_expiry_maxposts - 1
+            newest_first = self.model.objects.filter(visible).order_by('-db_pinned', '-db_date_created', '-id')
+            last_kept = newest_first \
+                .annotate(cutoff=Case(When(db_pinned=True, then=Value(LATEST_DATE, DateTimeField())),
+                                      default=F('db_date_created'), output_field=DateTimeField())) \
+                .values('cutoff')[offset:offset + 1]
+            last_kept_id = newest_first.values('id')[offset:offset + 1]
+
+            # Posts made at the same moment as the last one kept are ordered by id, as in by_board.
+            cutoff = Coalesce(Subquery(last_kept), Value(EARLIEST_DATE, DateTimeField()))
+            visible &= Q(db_pinned=True) | Q(db_date_created__gt=cutoff) | \
+                Q(db_date_created=cutoff, id__gte=Coalesce(Subquery(last_kept_id), Value(0)))
+
+        return visible
+
     def by_board(self, board):
         """
         Returns all the active posts on a board, honoring expiry limits.
@@ -72,30 +141,61 @@ class PostQuerySet(models.query.QuerySet):
             A list of Post objects.
 
         """
-        try:
-            if board.db_expiry_duration:
-                oldest = datetime.now() - timedelta(days=board.db_expiry_duration)
-                posts = self.filter(db_board=board).filter(Q(db_date_created__gte=oldest) | Q(db_pinned=True))\
-                    .order_by('-db_pinned', 'db_date_created')
-            else:
-                posts = self.filter(db_board=board).order_by('-db_pinned', 'db_date_created')
+        return self.filter(self.visible_filter(board)).order_by('-db_pinned', 'db_date_created', 'id')
 
-            # This is a little unfortunate
-            if board.db_expiry_maxposts and (board.db_expiry_maxposts > 0) and \
-                    (board.db_expiry_maxposts <= posts.count()):
-                pinned_count = self.filter(db_board=board, db_pinned=True).count()
-                max_normal = board.db_expiry_maxposts - (pinned_count + 1)
+    def board_position(self, post):
+        """
+        Returns the position of a post within the active posts on its board, as ordered by
+        by_board.  This counts the posts ahead of it in a single query, rather than loading
+        the whole board.
 
-                firstpost = posts[::-1][max_normal]
+        Args:
+            post (Post): The post to find.
+
+        Returns:
+            An integer, or None if the post isn't active on its board.
 
-                posts = self.filter(Q(db_board=board) & (Q(db_pinned=True) | (Q(pk__gte=firstpost.id)))) \
-                        .order_by('-db_pinned','db_date_created')
+        """
+        later = Q(db_date_created__gt=post.db_date_created) | Q(db_date_created=post.db_date_created, id__gte=post.id)
+        if post.db_pinned:
+            ahead = Q(db_pinned=True) & ~later
+        else:
+            ahead = Q(db_pinned=True) | ~later
 
+        result = self.filter(self.visible_filter(post.db_board)) \
+            .aggregate(ahead=Sum(Case(When(ahead, then=Value(1)), default=Value(0), output_field=IntegerField())),
+                       found=Sum(Case(When(pk=post.id, then=Value(1)), default=Value(0), output_field=IntegerField())))
 
-            return posts
+        if not result['found']:
+            return None
 
-        except self.model.DoesNotExist:
-            return []
+        return result['ahead'] + 1
+
+    def with_positions(self, boards):
+        """
+        Annotates each post with 'position', its place among the active posts on its board as
+        board_position works it out.  The posts ahead of each one are counted by a subquery, so
+        numbering a list of posts, such as search results, is still a single query.
+
+        Args:
+            boards (list): The boards the posts are on.
+
+        Returns:
+            A PostQuerySet.
+
+        """
+        visible = Q()
+        for b in boards:
+            visible |= self.visible_filter(b)
+
+        # Pinned posts come first, then the rest in the order they were made, as in by_board.
+        earlier = Q(db_date_created__lt=OuterRef('db_date_created')) | \
+            Q(db_date_created=OuterRef('db_date_created'), id__lt=OuterRef('id'))
+        ahead = Q(db_pinned__gt=OuterRef('db_pinned')) | (Q(db_pinned=OuterRef('db_pinned')) & earlier)
+        counts = self.model.objects.filter(visible).filter(ahead, db_board=OuterRef('db_board')).order_by() \
+            .values('db_board').annotate(ahead=Count('id')).values('ahead')
+
+        return self.annotate(position=Coalesce(Subquery(counts, output_field=IntegerField()), Value(0)) + 1)
 
     def by_board_for_player(self, board, player):
         """
@@ -110,41 +210,90 @@ class PostQuerySet(models.query.QuerySet):
             A list of Post objects.
 
         """
-        posts = self.by_board(board)
-        for p in posts:
-            if player.read_posts.filter(pk=p.id).exists():
-                setattr(p, "unread", False)
-            else:
-                setattr(p, "unread", True)
+        return self.by_board(board).with_unread(player)
 
-        return posts
+    def with_unread(self, player):
+        """
+        Annotates each post with an 'unread' field for the given player.
+
+        Args:
+            player (AccountDB): The player whose read/unread status should be used.
+
+        Returns:
+            A PostQuerySet.
+
+        """
+        return self.annotate(unread=Case(When(read_filter(player), then=Value(False)),
+                                         default=Value(True), output_field=BooleanField()))
 
     def by_board_threaded_player(self, board, player):
         """
-        Return just all the threads.
+        Return just all the threads, most recently active first.  The reply count and last reply
+        are read from the summary fields on each thread's first post, so this is a single query
+        which can be sliced for paging.
 
         Args:
             board: The board to get threads for
             player: The player whose unread states should be used
 
         Returns:
-            A list of Post objects
+            A PostQuerySet of Post objects
+
+        """
+        threads = self.filter(db_board=board, db_parent__isnull=True) \
+            .annotate(last_post_on=F('db_last_reply_at'), last_poster=F('db_last_reply_poster'),
+                      total_posts=F('db_reply_count') + 1) \
+            .order_by('-db_pinned', '-db_last_reply_at', '-id')
+
+        if player:
+            # A thread is read once its last reply is, or the thread itself if there aren't any.
+            read = read_filter(player, date_field='db_last_reply_at', post_field='db_last_reply') | \
+                (Q(db_last_reply__isnull=True) & read_filter(player))
+            threads = threads.annotate(unread=Case(When(read, then=Value(False)),
+                                                   default=Value(True), output_field=BooleanField()))
+
+        return threads
+
+    def after(self, post):
+        """
+        Keyset pagination: returns the posts which come after the given one in this queryset's
+        ordering.  Unlike an offset, this costs the same however deep into a board it goes, and
+        a page doesn't shift when new posts are made.
+
+        Args:
+            post (Post): The last post of the previous page.
+
+        Returns:
+            A PostQuerySet.
+
+        """
+        return self.filter(self._keyset_filter(post, later=True))
+
+    def before(self, post):
+        """
+        Keyset pagination in the other direction: returns the posts which come before the given
+        one in this queryset's ordering.  Reverse the result to get the nearest posts first.
+
+        Args:
+            post (Post): The first post of the following page.
+
+        Returns:
+            A PostQuerySet.
 
         """
-        posts = self.filter(db_board=board).filter(db_parent__isnull=True)
-        for p in posts:
-            lr = p.last_reply
-            setattr(p, "last_post_on", lr.db_date_created)
-            setattr(p, "last_poster", lr.db_poster_name)
-            replies = self.filter(db_parent=p)
-            setattr(p, "total_posts", replies.count() + 1)
-            if player:
-                if player.read_posts.filter(pk=lr.id).exists():
-                    setattr(p, "unread", False)
-                else:
-                    setattr(p, "unread", True)
+        return self.filter(self._keyset_filter(post, later=False))
+
+    def _keyset_filter(self, post, later):
+        beyond = Q()
+        equal = Q()
+        for field in self.query.order_by:
+            name = field.lstrip('-')
+            lookup = name + ('__lt' if field.startswith('-') == later else '__gt')
+            value = getattr(post, name)
+            beyond |= equal & Q(**{lookup: value})
+            equal &= Q(**{name: value})
 
-        return sorted(posts, key=lambda p: (p.db_pinned, p.date_for_sort), reverse=True)
+        return beyond
 
 
 class PostManager(SharedMemoryManager):
@@ -184,14 +333,190 @@ class PostManager(SharedMemoryManager):
         """
         return self.get_queryset().by_board_threaded_player(board, player)
 
-    def search(self, searchstring, board=None):
+    def search(self, searchstring, board=None, boards=None):
+        """
+        Searches posts using the configured search backend.
+
+        Args:
+            searchstring: The search string; see paxboards.search for the syntax.
+            board: If given, only search the visible posts on this board.
+            boards: If given, only search the visible posts on these boards.
+
+        Returns:
+            A queryset of matching posts, best matches first.
+
+        """
+        queryset = self.get_queryset()
         if board:
-            result = self.get_queryset().by_board(board).filter(db_text__icontains=searchstring).\
-                order_by('db_date_created')
-        else:
-            result = self.get_queryset().filter(db_text__icontains=searchstring).order_by('db_date_created')
+            boards = [board]
+        if boards is not None:
+            if not boards:
+                return queryset.none()
+
+            visible = Q()
+            for b in boards:
+                visible |= queryset.visible_filter(b)
+            queryset = queryset.filter(visible)
+
+        # Results are listed with their board and linked to their parent post.
+        queryset = queryset.select_related('db_board', 'db_parent')
+        return get_backend().search(queryset, searchstring)
+
+    def limit_changes(self, post):
+        """
+        Works out how a new post changed which posts are visible on its board.  Normally the post
+        is added and nothing drops off, but once a board with a post limit is full, its oldest
+        unpinned post drops off to make room; and if pinned posts fill the limit, the new post
+        never appears at all.  Only posts made before the new one are considered, so this gives
+        the same answer however late it's asked.
+
+        Args:
+            post (Post): The new post.
+
+        Returns:
+            A tuple of the post which was added, or None, and the post which dropped off, or
+            None.
+
+        """
+        limit = post.db_board.db_expiry_maxposts
+        if not limit or limit < 0:
+            return post, None
+
+        earlier = Q(db_date_created__lt=post.db_date_created) | \
+            Q(db_date_created=post.db_date_created, id__lt=post.id)
+        last = list(self.filter(db_board=post.db_board_id).filter(earlier)
+                    .order_by('-db_pinned', '-db_date_created', '-id')[limit - 1:limit])
+        if not last:
+            return post, None
+        if last[0].db_pinned:
+            return None, None
+
+        return post, last[0]
+
+
+class ReadMarkerManager(SharedMemoryManager):
+
+    def marker(self, player, board):
+        """
+        Returns the read marker for the given player and board, creating it if need be.
 
-        return result
+        Args:
+            player (AccountDB): The player whose read state should be returned.
+            board (BoardDB): The board the read state applies to.
+
+        Returns:
+            A ReadMarker object.
+
+        """
+        marker, _ = self.get_or_create(db_account=player, db_board=board)
+        return marker
+
+    # Posts which have been made but not yet added to the running unread counts, mapped to their
+    # boards.  Reading one of these doesn't change a count, and fresh counts of their boards
+    # aren't stored, since the pipeline's count stage is still to add them.
+    uncounted = {}
+
+    def count_new_post(self, post):
+        """
+        Adds a newly-made post to the running unread counts kept for its board, and tells the
+        online players who can read the board their new counts.  On a board with a post limit,
+        the post which dropped off the board to make room is taken off the counts at the same
+        time.  Players who can no longer read the board have their counts dropped instead, to be
+        counted afresh if they ever can again.  This runs as a stage of the post pipeline.
+
+        Args:
+            post (Post): The new post.
+
+        Returns:
+            None
+
+        """
+        global _AccountDB, _SESSIONS
+        if not _AccountDB:
+            from evennia.accounts.models import AccountDB as _AccountDB
+        if not _SESSIONS:
+            from evennia.server.sessionhandler import SESSIONS as _SESSIONS
+        from models import Post, send_unread_counts
+
+        try:
+            board = post.db_board
+            if not board.keeps_unread_counts or not Post.objects.filter(pk=post.id).exists():
+                return
+
+            markers = list(self.filter(db_board=board, db_unread_count__isnull=False))
+            if not markers:
+                return
+
+            # Each reader has one marker per board, so this checks each account's lock just once.
+            accounts = _AccountDB.objects.in_bulk([m.db_account_id for m in markers])
+            readable = set(pk for pk, account in accounts.items()
+                           if board.access(account, access_type='read', default=True))
+
+            added, dropped = Post.objects.limit_changes(post)
+            changes = dict((m.pk, 0) for m in markers if m.db_account_id in readable)
+            for changed, change in ((added, 1), (dropped, -1)):
+                if changed:
+                    read = self.read_by(changes.keys(), changed)
+                    for pk in changes:
+                        if pk not in read:
+                            changes[pk] += change
+
+            # Update the loaded markers as well as the rows, so cached copies don't go stale.
+            changed = []
+            for marker in markers:
+                if marker.db_account_id not in readable:
+                    marker.db_unread_count = None
+                elif changes[marker.pk]:
+                    marker.db_unread_count = max(marker.db_unread_count + changes[marker.pk], 0)
+                    changed.append(marker)
+
+            for change in (1, -1):
+                pks = [pk for pk, c in changes.items() if c == change]
+                if pks:
+                    self.filter(pk__in=pks).update(db_unread_count=Greatest(F('db_unread_count') + change, 0))
+            others = [m.pk for m in markers if m.db_account_id not in readable]
+            if others:
+                self.filter(pk__in=others).update(db_unread_count=None)
+
+            online = set(a.id for a in _SESSIONS.all_connected_accounts())
+            for marker in changed:
+                if marker.db_account_id in online:
+                    send_unread_counts(accounts[marker.db_account_id], [(board, marker.db_unread_count)])
+        finally:
+            self.uncounted.pop(post.id, None)
+
+    def read_by(self, markers, post):
+        """
+        Finds which of some read markers have a post marked read, in a single query.
+
+        Args:
+            markers (list): The ids of the read markers to check.
+            post (Post): The post.
+
+        Returns:
+            A set of read marker ids.
+
+        """
+        return set(self.filter(pk__in=markers)
+                   .filter(Q(db_read_until__gte=post.db_date_created) | Q(db_read_posts=post))
+                   .values_list('pk', flat=True))
+
+    def forget_unread_counts(self, board):
+        """
+        Drops the running unread counts kept for a board, so they're counted afresh the next
+        time they're needed, such as after a post is deleted or the board's expiry limits change.
+
+        Args:
+            board (BoardDB): The board.
+
+        Returns:
+            None
+
+        """
+        markers = self.filter(db_board=board, db_unread_count__isnull=False)
+        for marker in markers:
+            marker.db_unread_count = None
+        markers.update(db_unread_count=None)
 
 
 class BoardDBManager(SharedMemoryManager):
@@ -259,9 +584,10 @@ class BoardDBManager(SharedMemoryManager):
         except self.model.DoesNotExist:
             return None
 
-    def get_all_visible_boards(self, caller):
+    def get_readable_boards(self, caller):
         """
-        This function returns all the boards visible to a given viewer.
+        This function returns all the boards a given viewer has read access to, without
+        looking at their posts.
 
         Args:
             caller (Player): The player whose visibility of boards should be checked.
@@ -269,26 +595,118 @@ class BoardDBManager(SharedMemoryManager):
         Returns:
             A list of DefaultBoard objects.
         """
-        filtered = []
-        if caller:
-            tally = self.all().count()
-            filtered = [b for b in self.all() if b.access(caller, access_type='read', default=True)]
+        if not caller:
+            return []
+
+        return [b for b in self.all() if b.access(caller, access_type='read', default=True)]
+
+    def summarize_boards(self, boards, caller):
+        """
+        This function annotates each of the given boards with 'unread_count', 'total_count' and
+        'last_post' for a given viewer.  This takes a fixed number of queries no matter how many
+        boards or posts there are, aside from one query per board with a post limit.
+
+        Unread posts are only counted on boards where the viewer's read marker isn't already
+        keeping count; those counts are then stored on the markers, to be kept up to date from
+        then on.
+
+        Args:
+            boards (list): The DefaultBoard objects to annotate.
+            caller (Player): The player whose read/unread status should be used.
+
+        Returns:
+            The same list of DefaultBoard objects.
+        """
+        if not boards:
+            return boards
+
+        from models import Post, ReadMarker
+
+        visible = Q()
+        for b in boards:
+            visible |= Post.objects.get_queryset().visible_filter(b)
+
+        markers = {}
+        if getattr(caller, 'pk', None) is not None:
+            markers = dict((m.db_board_id, m) for m in ReadMarker.objects.filter(db_account=caller,
+                                                                                db_board__in=boards))
+        counted = dict((b.id, markers[b.id].db_unread_count) for b in boards
+                       if b.id in markers and markers[b.id].db_unread_count is not None and b.keeps_unread_counts)
+
+        # Boards with a running count are skipped before their read markers are looked at.
+        summaries = Post.objects.filter(visible).order_by().values('db_board') \
+            .annotate(total_count=Count('id'),
+                      unread_count=Sum(Case(When(db_board__in=list(counted), then=Value(0)),
+                                            When(read_filter(caller), then=Value(0)),
+                                            default=Value(1), output_field=IntegerField())))
+        summaries = dict((s['db_board'], s) for s in summaries)
+
+        # The latest post is looked up once per board, rather than inside the grouped query,
+        # where it would be looked up again for every post.
+        latest = Post.objects.filter(visible).filter(db_board=OuterRef('pk')) \
+            .order_by('db_pinned', '-db_date_created').values('pk')[:1]
+        latest_ids = dict(self.model.objects.filter(pk__in=[b.id for b in boards])
+                          .annotate(last_post=Subquery(latest)).values_list('pk', 'last_post'))
+        last_posts = Post.objects.in_bulk([pk for pk in latest_ids.values() if pk])
+
+        # Fresh counts aren't stored for boards whose new posts are still to be counted.
+        pending = set(ReadMarker.objects.uncounted.values())
+        recounted = {}
+        for b in boards:
+            summary = summaries.get(b.id, {})
+            unread_count = counted.get(b.id)
+            if unread_count is None:
+                unread_count = summary.get('unread_count') or 0
+                if b.keeps_unread_counts and b.id not in pending:
+                    recounted[b.id] = unread_count
+            setattr(b, "unread_count", unread_count)
+            setattr(b, "total_count", summary.get('total_count') or 0)
+            setattr(b, "last_post", last_posts.get(latest_ids.get(b.id)))
+
+        if recounted and getattr(caller, 'pk', None) is not None:
+            self.store_unread_counts(caller, recounted, markers)
+
+        return boards
+
+    def store_unread_counts(self, caller, counts, markers):
+        """
+        Stores freshly-counted unread posts on a player's read markers, creating the markers for
+        boards they haven't read yet.
+
+        Args:
+            caller (Player): The player the counts belong to.
+            counts (dict): Board ids and their unread counts.
+            markers (dict): Board ids and the player's existing read markers for them.
+
+        Returns:
+            None
+
+        """
+        from models import ReadMarker
 
-        for b in filtered:
-            all_posts = b.posts(caller)
-            unread = 0
-            for p in all_posts:
-                if p.is_unread:
-                    unread = unread + 1
+        existing = [markers[pk] for pk in counts if pk in markers]
+        if existing:
+            # Update the loaded markers as well as the rows, so cached copies don't go stale.
+            for marker in existing:
+                marker.db_unread_count = counts[marker.db_board_id]
+            ReadMarker.objects.filter(pk__in=[m.pk for m in existing]) \
+                .update(db_unread_count=Case(*[When(pk=m.pk, then=Value(m.db_unread_count)) for m in existing],
+                                             output_field=IntegerField()))
 
-            setattr(b, "unread_count", unread)
-            setattr(b, "total_count", len(all_posts))
+        ReadMarker.objects.bulk_create([ReadMarker(db_account=caller, db_board_id=pk, db_unread_count=count)
+                                        for pk, count in counts.items() if pk not in markers])
 
-            if all_posts:
-                last_post = list(all_posts)[-1]
-                setattr(b, "last_post", last_post)
+    def get_all_visible_boards(self, caller):
+        """
+        This function returns all the boards visible to a given viewer.
+
+        Args:
+            caller (Player): The player whose visibility of boards should be checked.
 
-        return filtered
+        Returns:
+            A list of DefaultBoard objects.
+        """
+        return self.summarize_boards(self.get_readable_boards(caller), caller)
 
     def get_visible_board(self, viewer, key):
         """
@@ -313,18 +731,7 @@ class BoardDBManager(SharedMemoryManager):
         if boards:
             filtered = [b for b in boards if b.access(viewer, access_type='read', default=True)]
             if len(filtered) == 1:
-                b = filtered[0]
-
-                all_posts = b.posts(viewer)
-                unread = 0
-                for p in all_posts:
-                    if p.is_unread:
-                        unread = unread + 1
-
-                setattr(b, "unread_count", unread)
-                setattr(b, "total_count", len(all_posts))
-
-                return b
+                return self.summarize_boards(filtered, viewer)[0]
 
         return None
 
@@ -345,6 +752,46 @@ class BoardDBManager(SharedMemoryManager):
 
         return []
 
+    def mark_all_read(self, caller, boards=None):
+        """
+        Marks every post on the given boards read for a player.  This is a fixed number of
+        queries, in one transaction, no matter how many boards or unread posts there are.
+
+        Args:
+            caller (Player): The player who is catching up.
+            boards (list): The boards to mark read; defaults to every board the player can read.
+
+        Returns:
+            None
+
+        """
+        if boards is None:
+            boards = self.get_readable_boards(caller)
+        if not caller or not boards:
+            return
+
+        from models import ReadMarker, send_unread_counts
+
+        now = timezone.now()
+        with transaction.atomic():
+            markers = ReadMarker.objects.filter(db_account=caller, db_board__in=boards)
+            # Update the loaded markers as well as the rows, so cached copies don't go stale.
+            existing = list(markers)
+            for marker in existing:
+                marker.db_read_until = now
+                marker.db_unread_count = 0
+            markers.update(db_read_until=now, db_unread_count=0)
+
+            marked = set(m.db_board_id for m in existing)
+            ReadMarker.objects.bulk_create([ReadMarker(db_account=caller, db_board=b, db_read_until=now,
+                                                       db_unread_count=0)
+                                            for b in boards if b.id not in marked])
+
+            ReadMarker.db_read_posts.through.objects.filter(readmarker__db_account=caller,
+                                                            readmarker__db_board__in=boards).delete()
+
+        send_unread_counts(caller, [(b, 0) for b in boards])
+
 
 class BoardManager(BoardDBManager, TypeclassManager):
     """
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def forwards(apps, schema_editor):
+    """
+    Converts the old per-post reader lists into read markers.  For each player and board, the
+    marker is set just past the longest run of posts (oldest first) the player has read, and any
+    newer posts they've read are kept as read out of order.
+
+    """
+    Post = apps.get_model('paxboards', 'Post')
+    ReadMarker = apps.get_model('paxboards', 'ReadMarker')
+    readers = Post.db_readers.through
+    read_posts = ReadMarker.db_read_posts.through
+
+    board_ids = Post.objects.values_list('db_board', flat=True).distinct()
+    for board_id in board_ids:
+        posts = list(Post.objects.filter(db_board=board_id).order_by('db_date_created', 'id')
+                     .values_list('id', 'db_date_created'))
+
+        read_by = {}
+        for account_id, post_id in readers.objects.filter(post__db_board=board_id) \
+                .values_list('accountdb_id', 'post_id'):
+            read_by.setdefault(account_id, set()).add(post_id)
+
+        for account_id, read in read_by.items():
+            read_until = None
+            index = 0
+            while index < len(posts) and posts[index][0] in read:
+                read_until = posts[index][1]
+                index += 1
+
+            marker = ReadMarker.objects.create(db_account_id=account_id, db_board_id=board_id,
+                                               db_read_until=read_until)
+            read_posts.objects.bulk_create([read_posts(readmarker_id=marker.id, post_id=post_id)
+                                            for post_id, _ in posts[index:] if post_id in read])
+
+
+def backwards(apps, schema_editor):
+    """
+    Expands read markers back into per-post reader lists.
+
+    """
+    Post = apps.get_model('paxboards', 'Post')
+    ReadMarker = apps.get_model('paxboards', 'ReadMarker')
+    readers = Post.db_readers.through
+
+    for marker in ReadMarker.objects.all():
+        read = Post.objects.filter(db_board=marker.db_board_id)
+        if marker.db_read_until:
+            read = read.filter(models.Q(db_date_created__lte=marker.db_read_until) |
+                               models.Q(pk__in=marker.db_read_posts.values('pk')))
+        else:
+            read = read.filter(pk__in=marker.db_read_posts.values('pk'))
+
+        readers.objects.bulk_create([readers(post_id=post_id, accountdb_id=marker.db_account_id)
+                                     for post_id in read.values_list('id', flat=True)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('paxboards', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReadMarker',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('db_read_until', models.DateTimeField(blank=True, help_text='All posts made at or before this time have been read.', null=True, verbose_name='read until')),
+                ('db_account', models.ForeignKey(help_text='Player this read state belongs to.', on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='reader')),
+                ('db_board', models.ForeignKey(help_text='Board this read state applies to.', on_delete=django.db.models.deletion.CASCADE, related_name='read_markers', to='paxboards.BoardDB', verbose_name='board')),
+                ('db_read_posts', models.ManyToManyField(blank=True, help_text='Newer posts which have been read out of order.', related_name='_readmarker_db_read_posts_+', to='paxboards.Post', verbose_name='read posts')),
+            ],
+            options={
+                'verbose_name': 'Read Marker',
+                'verbose_name_plural': 'Read Markers',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='readmarker',
+            unique_together=set([('db_account', 'db_board')]),
+        ),
+        migrations.RunPython(forwards, backwards),
+    ]
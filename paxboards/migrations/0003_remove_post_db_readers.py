@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paxboards', '0002_readmarker'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='post',
+            name='db_readers',
+        ),
+    ]
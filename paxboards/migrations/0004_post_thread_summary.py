@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def forwards(apps, schema_editor):
+    """
+    Fills in the reply summary for every existing post.
+
+    """
+    Post = apps.get_model('paxboards', 'Post')
+
+    for post in Post.objects.all().iterator():
+        replies = Post.objects.filter(db_parent=post.id).order_by('db_date_created', 'id')
+        last = replies.last()
+
+        post.db_reply_count = replies.count()
+        post.db_last_reply = last
+        post.db_last_reply_at = last.db_date_created if last else post.db_date_created
+        post.db_last_reply_poster = last.db_poster_name if last else post.db_poster_name
+        post.save(update_fields=['db_reply_count', 'db_last_reply', 'db_last_reply_at', 'db_last_reply_poster'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paxboards', '0003_remove_post_db_readers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='db_last_reply',
+            field=models.ForeignKey(blank=True, help_text='Most recent reply in this thread.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='paxboards.Post', verbose_name='last reply'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='db_last_reply_at',
+            field=models.DateTimeField(blank=True, help_text='Date of the most recent post in this thread.', null=True, verbose_name='last reply date'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='db_last_reply_poster',
+            field=models.CharField(blank=True, help_text='Display name of the most recent poster in this thread.', max_length=40, null=True, verbose_name='last reply poster'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='db_reply_count',
+            field=models.IntegerField(default=0, help_text='Number of replies in this thread.', verbose_name='reply count'),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
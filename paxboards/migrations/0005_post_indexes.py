@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paxboards', '0004_post_thread_summary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['db_board', 'db_pinned', 'db_date_created'], name='paxboards_post_board_date'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['db_board', 'db_parent', 'db_pinned', 'db_last_reply_at'], name='paxboards_post_board_thread'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['db_parent', 'db_date_created'], name='paxboards_post_parent_date'),
+        ),
+    ]
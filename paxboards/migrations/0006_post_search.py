@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# The full-text search index, as it was when this migration was written; later changes to the
+# index need migrations of their own.  {post} is the post table and {fts} the index.
+FTS_TABLE = 'paxboards_post_fts'
+
+INSERT = ("INSERT INTO {fts}(rowid, db_subject, db_text, db_poster_name) "
+          "VALUES (new.id, new.db_subject, new.db_text, new.db_poster_name);")
+DELETE = ("INSERT INTO {fts}({fts}, rowid, db_subject, db_text, db_poster_name) "
+          "VALUES ('delete', old.id, old.db_subject, old.db_text, old.db_poster_name);")
+
+FORWARDS = [
+    "CREATE VIRTUAL TABLE {fts} USING fts5(db_subject, db_text, db_poster_name, content='{post}', "
+    "content_rowid='id')",
+    "CREATE TRIGGER {fts}_insert AFTER INSERT ON {post} BEGIN " + INSERT + " END",
+    "CREATE TRIGGER {fts}_delete AFTER DELETE ON {post} BEGIN " + DELETE + " END",
+    "CREATE TRIGGER {fts}_update AFTER UPDATE OF db_subject, db_text, db_poster_name ON {post} BEGIN " +
+    DELETE + " " + INSERT + " END",
+    "INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+]
+
+BACKWARDS = [
+    "DROP TRIGGER IF EXISTS {fts}_insert",
+    "DROP TRIGGER IF EXISTS {fts}_delete",
+    "DROP TRIGGER IF EXISTS {fts}_update",
+    "DROP TABLE IF EXISTS {fts}",
+]
+
+
+class RunSQLiteSQL(migrations.RunSQL):
+    """
+    Runs SQL on SQLite built with FTS5 only, with the post table's name filled in.  Other
+    databases use the scanning search backend and don't need an index.
+
+    """
+
+    def run(self, app_label, schema_editor, state, statements):
+        connection = schema_editor.connection
+        if connection.vendor != 'sqlite':
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA compile_options")
+            if ('ENABLE_FTS5',) not in [tuple(row) for row in cursor.fetchall()]:
+                return
+
+        post = state.apps.get_model(app_label, 'Post')._meta.db_table
+        for statement in statements:
+            schema_editor.execute(statement.format(fts=FTS_TABLE, post=post), params=None)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        self.run(app_label, schema_editor, to_state, self.sql)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        self.run(app_label, schema_editor, from_state, self.reverse_sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paxboards', '0005_post_indexes'),
+    ]
+
+    operations = [
+        RunSQLiteSQL(FORWARDS, BACKWARDS),
+    ]
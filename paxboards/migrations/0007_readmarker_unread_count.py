@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paxboards', '0006_post_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='readmarker',
+            name='db_unread_count',
+            field=models.IntegerField(blank=True, help_text='How many visible posts on the board are unread, or blank if they need counting again.', null=True, verbose_name='unread count'),
+        ),
+    ]
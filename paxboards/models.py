@@ -1,16 +1,42 @@
 from __future__ import unicode_literals
 
+from datetime import timedelta
+
 from django.db import models
+from django.db.models import Max
+from django.utils import timezone
 from evennia.typeclasses.models import TypedObject
 from evennia.utils.idmapper.models import SharedMemoryModel
-from managers import PostManager
-from markdown import parser as markdown
+from managers import PostManager, ReadMarkerManager
+from markdown import cache as markdown
 
 from utils import notifications
 
 from .board_utils import datetime_to_full
 
-__all__ = ("Post", "BoardDB")
+__all__ = ("Post", "BoardDB", "ReadMarker", "send_unread_counts")
+
+
+def send_unread_counts(account, counts, session=None):
+    """
+    Tells an account's clients how many unread posts there are on some boards, as a
+    'bboard_unread' OOB message (the Bboard.Unread package over GMCP), so that they can show
+    unread badges without having to ask.  The message's keyword arguments map board names to
+    unread counts.
+
+    Args:
+        account (AccountDB): The account to tell.
+        counts (list): (board, unread count) pairs.
+        session (Session): If given, only this session is told.
+
+    Returns:
+        None
+
+    """
+    if not counts:
+        return
+
+    account.msg(bboard_unread=dict((board.name, count) for board, count in counts), session=session)
 
 
 class Post(SharedMemoryModel):
@@ -26,10 +52,17 @@ class Post(SharedMemoryModel):
     - db_board: The board on which this post was made.
     - db_date_created: The timestamp when this post was made.
     - db_pinned: A boolean, determining if the post should be prevented from timing out.
-    - db_readers: A list of players who have read this post.
     - db_parent: For threaded post chains, the parent to this post.
     - db_text: The actual text of the post.
 
+    The first post in a thread also keeps a summary of its replies, so that threads can be
+    listed without looking at the replies themselves:
+
+    - db_reply_count: How many replies the thread has.
+    - db_last_reply: The most recent reply, or None if there are no replies.
+    - db_last_reply_at: When the most recent reply (or the post itself) was made.
+    - db_last_reply_poster: The display name of whoever made the most recent reply (or the post).
+
     """
     db_poster_player = models.ForeignKey("accounts.AccountDB", related_name="+", null=True, blank=True,
                                          verbose_name="poster(player)", db_index=True,
@@ -45,11 +78,17 @@ class Post(SharedMemoryModel):
                                            auto_now_add=True, db_index=True, help_text='Date post was made.')
     db_pinned = models.BooleanField(verbose_name="pinned",
                                     help_text='Should the post remain visible even after expiration?')
-    db_readers = models.ManyToManyField("accounts.AccountDB", related_name="read_posts", blank=True,
-                                        verbose_name="readers", help_text='Players who have read this post.')
     db_parent = models.ForeignKey('Post', verbose_name='parent', related_name='replies', null=True, blank=True,
                                   help_text='Parent/child map for threaded replies.')
     db_text = models.TextField(verbose_name="post_text", null=True, blank=True, help_text='Text of the post.')
+    db_reply_count = models.IntegerField(verbose_name="reply count", default=0,
+                                         help_text='Number of replies in this thread.')
+    db_last_reply = models.ForeignKey('Post', verbose_name='last reply', related_name='+', null=True, blank=True,
+                                      on_delete=models.SET_NULL, help_text='Most recent reply in this thread.')
+    db_last_reply_at = models.DateTimeField('last reply date', null=True, blank=True,
+                                            help_text='Date of the most recent post in this thread.')
+    db_last_reply_poster = models.CharField(max_length=40, verbose_name="last reply poster", null=True, blank=True,
+                                            help_text='Display name of the most recent poster in this thread.')
 
     objects = PostManager()
 
@@ -57,6 +96,14 @@ class Post(SharedMemoryModel):
         "Define Django meta options"
         verbose_name = "Post"
         verbose_name_plural = "Posts"
+        # These match the filters and orderings used by PostQuerySet: a board's posts in
+        # pinned/date order, a board's threads in pinned/activity order, and a thread's replies.
+        indexes = [
+            models.Index(fields=['db_board', 'db_pinned', 'db_date_created'], name='paxboards_post_board_date'),
+            models.Index(fields=['db_board', 'db_parent', 'db_pinned', 'db_last_reply_at'],
+                         name='paxboards_post_board_thread'),
+            models.Index(fields=['db_parent', 'db_date_created'], name='paxboards_post_parent_date'),
+        ]
 
     def __str__(self):
         return "<Post " + str(self.id) + " by " + self.db_poster_name + ": " + self.db_subject + \
@@ -107,11 +154,11 @@ class Post(SharedMemoryModel):
         if not player:
             return
 
+        marker = ReadMarker.objects.marker(player, self.db_board)
         if has_read:
-            self.db_readers.add(player)
+            marker.mark_read(self)
         else:
-            self.db_readers.remove(player)
-        self.save()
+            marker.mark_unread(self)
 
     @property
     def post_num(self):
@@ -120,11 +167,10 @@ class Post(SharedMemoryModel):
         its parent board.
 
         Returns:
-            An integer.
+            An integer, or None if the post has expired.
 
         """
-        posts = Post.objects.posts(self.db_board)
-        return list(posts).index(self) + 1 if self in posts else None
+        return Post.objects.get_queryset().board_position(self)
 
     @property
     def last_reply(self):
@@ -135,16 +181,46 @@ class Post(SharedMemoryModel):
             there are none.
 
         """
-        posts = Post.objects.filter(db_parent=self).order_by('db_date_created')
-        if posts:
-            return posts.last()
+        return self.db_last_reply or self
 
-        return self
+    def add_reply(self, reply):
+        """
+        Updates this thread's reply summary for a newly-made reply.
+
+        Args:
+            reply (Post): The new reply.
+
+        Returns:
+            None
+
+        """
+        self.db_reply_count += 1
+        self.db_last_reply = reply
+        self.db_last_reply_at = reply.db_date_created
+        self.db_last_reply_poster = reply.db_poster_name
+        self.save(update_fields=['db_reply_count', 'db_last_reply', 'db_last_reply_at', 'db_last_reply_poster'])
+
+    def update_replies(self):
+        """
+        Recalculates this thread's reply summary from its replies, such as after one is deleted.
+
+        Returns:
+            None
+
+        """
+        replies = Post.objects.filter(db_parent=self).order_by('db_date_created', 'id')
+        last = replies.last()
+
+        self.db_reply_count = replies.count()
+        self.db_last_reply = last
+        self.db_last_reply_at = last.db_date_created if last else self.db_date_created
+        self.db_last_reply_poster = last.db_poster_name if last else self.db_poster_name
+        self.save(update_fields=['db_reply_count', 'db_last_reply', 'db_last_reply_at', 'db_last_reply_poster'])
 
     @property
     def is_unread(self):
         if hasattr(self, 'unread'):
-            return getattr(self, 'unread')
+            return bool(getattr(self, 'unread'))
 
         return False
 
@@ -171,6 +247,13 @@ class Post(SharedMemoryModel):
     def poster(self):
         return self.db_poster_name
 
+    @property
+    def render_key(self):
+        """
+        The key this post's rendered text is cached under; see markdown.cache.
+        """
+        return "post:" + str(self.id)
+
     def display_post(self, player, show_replies=False):
         post_num = self.post_num
 
@@ -183,8 +266,6 @@ class Post(SharedMemoryModel):
 
         note = notifications.Notification(player, border=True, header=postid)
 
-        post_md = markdown.MarkdownParser(self.db_text)
-
         post_string = "|555Date   :|n " + datestring + "\n"
         post_string += "|555Poster :|n " + self.db_poster_name + "\n"
         post_string += "|555Subject:|n " + self.db_subject
@@ -192,12 +273,11 @@ class Post(SharedMemoryModel):
             post_string += " |555(Pinned)|n"
         note.add_line(post_string)
         note.add_divider()
-        note.add_line(post_md.as_mush())
+        note.add_line(markdown.as_mush(self.db_text, key=self.render_key))
 
         if show_replies:
             replies = Post.objects.filter(db_parent=self).order_by('db_date_created')
             for r in replies:
-                post_md = markdown.MarkdownParser(r.db_text)
                 datestring = unicode(str(r.db_date_created.year)) + u'/'
                 datestring += unicode(str(r.db_date_created.month)).rjust(2, '0') + u'/'
                 datestring += unicode(str(r.db_date_created.day)).rjust(2, '0')
@@ -206,7 +286,7 @@ class Post(SharedMemoryModel):
                 post_string += "|555Poster :|n " + r.db_poster_name + "\n"
                 post_string += "--------"
                 note.add_line(post_string)
-                note.add_line(post_md.as_mush())
+                note.add_line(markdown.as_mush(r.db_text, key=r.render_key))
 
         note.send(player)
 
@@ -244,3 +324,183 @@ class BoardDB(TypedObject):
         "Echoes the text representation of the board."
         return "Board '%s' (%s)" % (self.key, self.db.desc)
 
+    @property
+    def keeps_unread_counts(self):
+        """
+        Whether read markers keep a running count of this board's unread posts.  On boards with
+        an age limit, posts drop off as time passes rather than when anything happens to the
+        board, so their unread posts are counted afresh each time instead.  On boards with a post
+        limit, the counts are adjusted as posts drop off to make room for new ones.
+
+        Returns:
+            True or False
+
+        """
+        return not self.db_expiry_duration
+
+
+
+class ReadMarker(SharedMemoryModel):
+    """
+    Tracks how far a single player has read on a single board.
+
+    Rather than recording every (post, reader) pair, a marker keeps a timestamp below which every
+    post counts as read, plus a small set of newer posts which were read out of order.  Reading
+    in order moves the timestamp forward and empties that set again.
+
+    - db_account: The player whose read state this is.
+    - db_board: The board this read state applies to.
+    - db_read_until: Every post created at or before this timestamp has been read.
+    - db_read_posts: Posts newer than db_read_until which have been read out of order.
+    - db_unread_count: How many visible posts on the board are unread, kept up to date as posts
+      are made and read so the board list doesn't need to count them, or None if they need
+      counting again.  This isn't kept for boards with an age limit.
+
+    """
+    db_account = models.ForeignKey("accounts.AccountDB", related_name="+", verbose_name="reader", db_index=True,
+                                   help_text='Player this read state belongs to.')
+    db_board = models.ForeignKey("BoardDB", related_name="read_markers", verbose_name="board", db_index=True,
+                                 help_text='Board this read state applies to.')
+    db_read_until = models.DateTimeField('read until', null=True, blank=True,
+                                         help_text='All posts made at or before this time have been read.')
+    db_read_posts = models.ManyToManyField("Post", related_name="+", blank=True, verbose_name="read posts",
+                                           help_text='Newer posts which have been read out of order.')
+    db_unread_count = models.IntegerField('unread count', null=True, blank=True,
+                                          help_text='How many visible posts on the board are unread, or blank if '
+                                                    'they need counting again.')
+
+    objects = ReadMarkerManager()
+
+    class Meta(object):
+        "Define Django meta options"
+        verbose_name = "Read Marker"
+        verbose_name_plural = "Read Markers"
+        unique_together = (("db_account", "db_board"),)
+
+    def __str__(self):
+        return "<ReadMarker " + str(self.db_account_id) + " on " + str(self.db_board_id) + ">"
+
+    def __unicode__(self):
+        return unicode(str(self))
+
+    def __repr__(self):
+        return str(self)
+
+    def is_read(self, post):
+        """
+        Checks whether the given post has been read.
+
+        Args:
+            post (Post): The post to check.
+
+        Returns:
+            True or False
+
+        """
+        if self.db_read_until and post.db_date_created <= self.db_read_until:
+            return True
+
+        return self.db_read_posts.filter(pk=post.id).exists()
+
+    def mark_read(self, post):
+        """
+        Marks a single post read, then moves the marker forward past any posts that are now
+        read in order.
+
+        Args:
+            post (Post): The post to mark read.
+
+        Returns:
+            None
+
+        """
+        if self.is_read(post):
+            return
+
+        self.db_read_posts.add(post)
+        self.compact()
+        self.change_unread_count(-1, post)
+
+    def mark_unread(self, post):
+        """
+        Marks a single post unread.  If the post is below the marker, the marker is pulled back
+        to just before it, and the posts in between are kept as read out of order.
+
+        Args:
+            post (Post): The post to mark unread.
+
+        Returns:
+            None
+
+        """
+        if not self.is_read(post):
+            return
+
+        if self.db_read_until and post.db_date_created <= self.db_read_until:
+            between = Post.objects.filter(db_board=self.db_board_id,
+                                          db_date_created__gt=post.db_date_created,
+                                          db_date_created__lte=self.db_read_until)
+            through = ReadMarker.db_read_posts.through
+            through.objects.bulk_create([through(readmarker_id=self.id, post_id=pk)
+                                         for pk in between.values_list('id', flat=True)])
+
+            self.db_read_until = post.db_date_created - timedelta(microseconds=1)
+            self.save(update_fields=['db_read_until'])
+
+        self.db_read_posts.remove(post)
+        self.change_unread_count(1, post)
+
+    def change_unread_count(self, change, post):
+        """
+        Adjusts the running count of unread posts, if one is being kept, and tells the player's
+        clients the new count.  Posts which aren't part of the count -- ones the post pipeline
+        hasn't counted yet, or ones which have dropped off a board with a post limit -- leave it
+        as it is.
+
+        Args:
+            change (int): How many more (or, if negative, fewer) posts are unread.
+            post (Post): The post which was read or unread.
+
+        Returns:
+            None
+
+        """
+        board = self.db_board
+        if self.db_unread_count is None or not board.keeps_unread_counts or \
+                post.id in ReadMarker.objects.uncounted:
+            return
+
+        if board.db_expiry_maxposts and \
+                not Post.objects.filter(Post.objects.get_queryset().visible_filter(board), pk=post.id).exists():
+            return
+
+        self.db_unread_count = max(self.db_unread_count + change, 0)
+        self.save(update_fields=['db_unread_count'])
+        send_unread_counts(self.db_account, [(self.db_board, self.db_unread_count)])
+
+    def compact(self):
+        """
+        Moves db_read_until up to just before the oldest visible post that is still unread, and
+        drops the out-of-order posts that no longer need to be remembered.
+
+        Returns:
+            None
+
+        """
+        posts = Post.objects.posts(self.db_board)
+        if self.db_read_until:
+            posts = posts.filter(db_date_created__gt=self.db_read_until)
+
+        first_unread = posts.exclude(pk__in=self.db_read_posts.values('pk')).order_by('db_date_created', 'id').first()
+        if first_unread:
+            read_until = first_unread.db_date_created - timedelta(microseconds=1)
+        else:
+            read_until = Post.objects.filter(db_board=self.db_board_id).aggregate(latest=Max('db_date_created'))['latest']
+
+        if not read_until or (self.db_read_until and read_until <= self.db_read_until):
+            return
+
+        self.db_read_until = read_until
+        self.save(update_fields=['db_read_until'])
+        ReadMarker.db_read_posts.through.objects.filter(readmarker_id=self.id,
+                                                        post__db_date_created__lte=read_until).delete()
@@ -0,0 +1,227 @@
+"""
+The work that follows making a post.
+
+Only saving the post (along with its thread's summary) happens while the posting command runs.
+Everything else -- adding it to the readers' unread counts, working out its number on its
+board, announcing it to subscribers and rendering its text ahead of the first read -- is queued
+here and done in stages, one stage per pass of the reactor, so that other players' commands
+aren't held up behind a post, however many readers its board has.
+
+Stages run in the reactor's thread rather than in a thread pool: they use the shared database
+object caches and send output to sessions, neither of which is safe to do from another thread.
+Posts made from the website are handed over to the reactor's thread to be queued.
+
+How long each stage takes is tracked in PIPELINE.timings, and shown by bbadmin/pipeline.
+"""
+import time
+from collections import deque, OrderedDict
+
+from evennia.utils import logger
+from evennia.utils.utils import delay
+from markdown import cache as markdown
+from paxboards.models import ReadMarker
+from twisted.internet import reactor
+from twisted.python import threadable
+
+from utils import notifications
+
+
+class StageTimer(object):
+    """
+    How often a stage has run, and how long it has taken.
+    """
+
+    __slots__ = ('runs', 'failures', 'total', 'slowest', 'last')
+
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.last = 0.0
+
+    def record(self, elapsed, failed=False):
+        """
+        Records a single run of the stage.
+
+        Args:
+            elapsed (float): How long it took, in seconds.
+            failed (bool): Whether it raised an error.
+
+        Returns:
+            None
+
+        """
+        self.runs += 1
+        self.total += elapsed
+        self.last = elapsed
+        self.slowest = max(self.slowest, elapsed)
+        if failed:
+            self.failures += 1
+
+    @property
+    def average(self):
+        return self.total / self.runs if self.runs else 0.0
+
+    def as_dict(self):
+        """
+        Returns:
+            The timings as a dictionary, in milliseconds.
+
+        """
+        return {
+            'runs': self.runs,
+            'failures': self.failures,
+            'average_ms': round(self.average * 1000, 3),
+            'slowest_ms': round(self.slowest * 1000, 3),
+            'last_ms': round(self.last * 1000, 3),
+        }
+
+
+class PostPipeline(object):
+    """
+    Runs a list of stages over each new post, in the order the posts were made.  Each stage is
+    called with the post and a dictionary it can leave results in for the stages after it.  If a
+    stage fails, the error is logged and the rest of that post's stages are skipped.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.timings = OrderedDict((name, StageTimer()) for name, _ in stages)
+        # From a post being queued to its last stage finishing, including time spent waiting.
+        self.timings['total'] = StageTimer()
+        self.queue = deque()
+        self.scheduled = False
+
+    def submit(self, post):
+        """
+        Queues the stages for a newly-made post.  This can be called from any thread.
+
+        Args:
+            post (Post): The new post.
+
+        Returns:
+            None
+
+        """
+        job = [post, {}, 0, time.time()]
+        # Before the reactor is running (such as in tests and scripts) there's only one thread.
+        if threadable.ioThread is None or threadable.isInIOThread():
+            self.enqueue(job)
+        else:
+            reactor.callFromThread(self.enqueue, job)
+
+    def enqueue(self, job):
+        self.queue.append(job)
+        self.schedule()
+
+    def schedule(self):
+        if self.queue and not self.scheduled:
+            self.scheduled = True
+            delay(0, self.run_next)
+
+    def run_next(self):
+        """
+        Runs the next waiting stage, then schedules the one after it.
+
+        Returns:
+            None
+
+        """
+        self.scheduled = False
+        if not self.queue:
+            return
+
+        job = self.queue[0]
+        post, context, index, queued_at = job
+        name, stage = self.stages[index]
+
+        start = time.time()
+        failed = False
+        try:
+            stage(post, context)
+        except Exception:
+            logger.log_trace("Post pipeline stage '%s' failed for post %s." % (name, post.id))
+            failed = True
+        self.timings[name].record(time.time() - start, failed)
+
+        job[2] += 1
+        if failed or job[2] >= len(self.stages):
+            self.queue.popleft()
+            self.timings['total'].record(time.time() - queued_at, failed)
+
+        self.schedule()
+
+    def drain(self):
+        """
+        Runs every waiting stage straight away, such as in tests, where the reactor isn't
+        running.
+
+        Returns:
+            None
+
+        """
+        while self.queue:
+            self.run_next()
+
+    @property
+    def backlog(self):
+        """
+        Returns:
+            How many posts still have stages waiting to run.
+
+        """
+        return len(self.queue)
+
+    def report(self):
+        """
+        Returns:
+            The timings of every stage, as a dictionary.
+
+        """
+        return OrderedDict((name, timer.as_dict()) for name, timer in self.timings.items())
+
+
+def count_post(post, context):
+    """
+    Adds the post to its readers' unread counts, and sends them their new counts.
+    """
+    ReadMarker.objects.count_new_post(post)
+
+
+def number_post(post, context):
+    """
+    Works out the post's number on its board, which is None if it has already expired (or been
+    deleted).
+    """
+    context['number'] = post.post_num
+
+
+def announce_post(post, context):
+    """
+    Tells the board's subscribers about the post.
+    """
+    if not context.get('number'):
+        return
+
+    board = post.db_board
+    announcement = "New post by |555" + post.db_poster_name + ":|n (" + board.name + "/" + \
+                   str(context['number']) + "): |555" + post.db_subject + "|n"
+
+    notifications.Notification.send_as_notification(announcement, list=board.subscribers(),
+                                                     notification_type="board")
+
+
+def render_post(post, context):
+    """
+    Renders the post's text into the Markdown cache, so the first player to read it doesn't wait.
+    """
+    markdown.as_mush(post.db_text, key=post.render_key)
+
+
+PIPELINE = PostPipeline([
+    ('count', count_post),
+    ('number', number_post),
+    ('announce', announce_post),
+    ('render', render_post),
+])
@@ -0,0 +1,213 @@
+"""
+Search backends for bboard posts.
+
+A backend turns a search string into a filtered, ordered Post queryset.  The backend in use is
+named by the PAXBOARDS_SEARCH_BACKEND setting; if that isn't set, SQLite databases use the FTS5
+index (created by the paxboards migrations, if SQLite was built with FTS5) and every other
+database falls back to scanning the post text.
+
+Search strings are a list of terms, all of which must match.  A term is a word or a "quoted
+phrase", and may be limited to one field with a prefix, as in subject:meeting or poster:"Pax".
+
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+_TERM_RE = re.compile(r'(?:(\w+):)?(?:"([^"]*)"?|(\S+))')
+_backend = None
+
+
+def parse_query(searchstring):
+    """
+    Splits a search string into terms.
+
+    Args:
+        searchstring: The search string to parse.
+
+    Returns:
+        A list of (field, text, phrase) tuples, where field is one of the keys of
+        SearchBackend.fields or None for the default fields, and phrase is True if the term was
+        quoted.
+
+    """
+    terms = []
+    for match in _TERM_RE.finditer(searchstring or ""):
+        field, phrase, word = match.groups()
+        if field and field.lower() not in SearchBackend.fields:
+            # Not a field we know, so the colon was part of the word.
+            field, phrase, word = None, None, match.group(0)
+        text = (phrase if phrase is not None else word).strip()
+        if text:
+            terms.append((field.lower() if field else None, text, phrase is not None))
+
+    return terms
+
+
+class SearchBackend(object):
+    """
+    Searches posts by scanning their fields.  This works on any database, but it can't use an
+    index and results are only ordered by date.
+
+    """
+
+    fields = {
+        'subject': ['db_subject'],
+        'text': ['db_text'],
+        'poster': ['db_poster_name'],
+    }
+    default_fields = ['db_subject', 'db_text']
+
+    def search(self, queryset, searchstring):
+        """
+        Filters a queryset of posts down to those matching a search string.
+
+        Args:
+            queryset: The posts to search.
+            searchstring: The search string.
+
+        Returns:
+            The matching posts, best matches first.
+
+        """
+        terms = parse_query(searchstring)
+        if not terms:
+            return queryset.none()
+
+        for field, text, _ in terms:
+            match = Q()
+            for name in self.fields[field] if field else self.default_fields:
+                match |= Q(**{name + '__icontains': text})
+            queryset = queryset.filter(match)
+
+        return queryset.order_by('db_date_created', 'id')
+
+
+class FTSSearchBackend(SearchBackend):
+    """
+    Searches posts using SQLite's FTS5 full-text index, ranking results by relevance.  The
+    index is kept up to date by triggers on the post table, so posts are indexed however they
+    are created, edited or deleted.
+
+    """
+
+    table = 'paxboards_post_fts'
+
+    def match_expression(self, terms):
+        """
+        Builds an FTS5 MATCH expression from parsed search terms.  Every term is quoted, so
+        nothing the player types is taken as FTS5 syntax; words match as prefixes.
+
+        Args:
+            terms: Terms as returned by parse_query.
+
+        Returns:
+            The MATCH expression.
+
+        """
+        parts = []
+        for field, text, phrase in terms:
+            columns = self.fields[field] if field else self.default_fields
+            quoted = '"' + text.replace('"', '""') + '"' + ('' if phrase else '*')
+            parts.append('{' + ' '.join(columns) + '} : ' + quoted)
+
+        return ' AND '.join(parts)
+
+    def search(self, queryset, searchstring):
+        terms = parse_query(searchstring)
+        if not terms:
+            return queryset.none()
+
+        expression = self.match_expression(terms)
+        table = queryset.model._meta.db_table
+        match = 'SELECT {r} FROM {t} WHERE {t} MATCH %s'
+        # RawSQL can't be used with __in here, since the extra parentheses it adds make SQLite
+        # treat the subquery as a single value.
+        matches = table + '.id IN (' + match.format(r='rowid', t=self.table) + ')'
+        rank = RawSQL(match.format(r='rank', t=self.table) + ' AND rowid = ' + table + '.id', [expression])
+
+        return queryset.extra(where=[matches], params=[expression]).annotate(search_rank=rank)\
+            .order_by('search_rank', 'db_date_created', 'id')
+
+    @classmethod
+    def available(cls, connection):
+        """
+        Checks whether a database can use the index: it has to be SQLite, built with FTS5, and
+        the index has to have been made.
+
+        Args:
+            connection: The database connection.
+
+        Returns:
+            True or False
+
+        """
+        if connection.vendor != 'sqlite':
+            return False
+
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA compile_options")
+            if ('ENABLE_FTS5',) not in [tuple(row) for row in cursor.fetchall()]:
+                return False
+
+        return cls.table in connection.introspection.table_names()
+
+    @classmethod
+    def install(cls, schema_editor):
+        """
+        Creates the FTS5 index and the triggers that keep it current, and indexes any existing
+        posts, such as for a test database built without migrations.  The migrations keep their
+        own copy of this SQL, so changing the index here needs a new migration as well.
+
+        """
+        from models import Post
+
+        post = Post._meta.db_table
+        columns = ', '.join(['db_subject', 'db_text', 'db_poster_name'])
+        new_values = ', '.join(['new.db_subject', 'new.db_text', 'new.db_poster_name'])
+        old_values = ', '.join(['old.db_subject', 'old.db_text', 'old.db_poster_name'])
+        delete = ("INSERT INTO {t}({t}, rowid, {c}) VALUES ('delete', old.id, {o});"
+                  .format(t=cls.table, c=columns, o=old_values))
+        insert = "INSERT INTO {t}(rowid, {c}) VALUES (new.id, {n});".format(t=cls.table, c=columns, n=new_values)
+
+        schema_editor.execute("CREATE VIRTUAL TABLE {t} USING fts5({c}, content='{p}', "
+                              "content_rowid='id')".format(t=cls.table, c=columns, p=post))
+        schema_editor.execute("CREATE TRIGGER {t}_insert AFTER INSERT ON {p} BEGIN {i} END"
+                              .format(t=cls.table, p=post, i=insert))
+        schema_editor.execute("CREATE TRIGGER {t}_delete AFTER DELETE ON {p} BEGIN {d} END"
+                              .format(t=cls.table, p=post, d=delete))
+        schema_editor.execute("CREATE TRIGGER {t}_update AFTER UPDATE OF {c} ON {p} BEGIN {d} {i} END"
+                              .format(t=cls.table, c=columns, p=post, d=delete, i=insert))
+        schema_editor.execute("INSERT INTO {t}({t}) VALUES ('rebuild')".format(t=cls.table))
+
+    @classmethod
+    def uninstall(cls, schema_editor):
+        """
+        Removes the FTS5 index and its triggers.
+
+        """
+        for suffix in ['insert', 'delete', 'update']:
+            schema_editor.execute("DROP TRIGGER IF EXISTS {t}_{s}".format(t=cls.table, s=suffix))
+        schema_editor.execute("DROP TABLE IF EXISTS " + cls.table)
+
+
+def get_backend():
+    """
+    Returns the configured search backend, creating it on first use.
+
+    """
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'PAXBOARDS_SEARCH_BACKEND', None)
+        if path:
+            _backend = import_string(path)()
+        elif FTSSearchBackend.available(connection):
+            _backend = FTSSearchBackend()
+        else:
+            _backend = SearchBackend()
+
+    return _backend
@@ -1,3 +1,608 @@
-from django.test import TestCase
+import random
+import re
+from datetime import timedelta
 
-# Create your tests here.
+from mock import patch
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from evennia.server.sessionhandler import SESSIONS
+from evennia.typeclasses.models import TypedObject
+from evennia.utils.test_resources import EvenniaTest
+
+from markdown import cache as markdown
+from markdown.parser import MarkdownParser
+from paxboards.access import ACCESS_CACHE
+from paxboards.board_commands import BoardContext
+from paxboards.boards import DefaultBoard
+from paxboards.models import Post, ReadMarker
+from paxboards.pipeline import PIPELINE
+from paxboards.search import FTSSearchBackend, SearchBackend, get_backend, parse_query
+
+
+def expected_by_board(posts, board, now):
+    """
+    A plain-Python model of how post expiry has always behaved, for comparing against
+    PostQuerySet.by_board.  Posts are given as (id, date, pinned) tuples, oldest first.  The one
+    difference is when pinned posts alone fill the post limit; that used to show an arbitrary
+    set of unpinned posts, and now shows none.
+    """
+    if board.db_expiry_duration:
+        oldest = now - timedelta(days=board.db_expiry_duration)
+        posts = [p for p in posts if p[1] >= oldest or p[2]]
+
+    pinned = [p for p in posts if p[2]]
+    normal = [p for p in posts if not p[2]]
+    if board.db_expiry_maxposts and board.db_expiry_maxposts <= len(posts):
+        keep = board.db_expiry_maxposts - len(pinned)
+        normal = normal[-keep:] if keep > 0 else []
+
+    return [p[0] for p in pinned + normal]
+
+
+class TestBoardQueries(EvenniaTest):
+
+    def setUp(self):
+        super(TestBoardQueries, self).setUp()
+        self.board = DefaultBoard(db_key="Announcements")
+        self.board.save()
+
+    def make_posts(self, count):
+        for i in range(count):
+            self.board.create_post("Subject " + str(i), "Text " + str(i), author_name="Tester")
+        PIPELINE.drain()
+
+    def count_queries(self, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            result = func(*args, **kwargs)
+        return len(context.captured_queries), result
+
+    def test_unread_annotation_query_count(self):
+        self.make_posts(3)
+        small, _ = self.count_queries(lambda: list(self.board.posts(self.account)))
+        self.make_posts(30)
+        large, posts = self.count_queries(lambda: list(self.board.posts(self.account)))
+
+        self.assertEqual(len(posts), 33)
+        self.assertEqual(small, large)
+
+    def test_unread_annotation(self):
+        self.make_posts(3)
+        posts = list(self.board.posts(self.account))
+        posts[1].mark_read(self.account, True)
+
+        posts = list(self.board.posts(self.account))
+        self.assertEqual([p.is_unread for p in posts], [True, False, True])
+
+    def test_read_marker(self):
+        self.make_posts(4)
+        posts = list(self.board.posts(self.account))
+        marker = ReadMarker.objects.marker(self.account, self.board)
+
+        posts[2].mark_read(self.account, True)
+        self.assertEqual(marker.db_read_posts.count(), 1)
+
+        posts[0].mark_read(self.account, True)
+        posts[1].mark_read(self.account, True)
+        self.assertEqual(marker.db_read_posts.count(), 0)
+        self.assertEqual([p.is_unread for p in self.board.posts(self.account)], [False, False, False, True])
+
+        posts[1].mark_read(self.account, False)
+        self.assertEqual([p.is_unread for p in self.board.posts(self.account)], [False, True, False, True])
+
+        self.board.mark_all_read(self.account)
+        self.assertEqual([p.is_unread for p in self.board.posts(self.account)], [False, False, False, False])
+        self.assertEqual([p.is_unread for p in self.board.posts(self.account2)], [True, True, True, True])
+
+    def test_catchup_all(self):
+        self.make_posts(3)
+        list(self.board.posts(self.account))[1].mark_read(self.account, True)
+        for i in range(2):
+            board = DefaultBoard(db_key="Board " + str(i))
+            board.save()
+            board.create_post("Subject", "Text", author_name="Tester")
+
+        queries, _ = self.count_queries(DefaultBoard.objects.mark_all_read, self.account)
+        boards = DefaultBoard.objects.get_all_visible_boards(self.account)
+        self.assertEqual([b.unread_count for b in boards], [0, 0, 0])
+        self.assertEqual(ReadMarker.db_read_posts.through.objects.count(), 0)
+        self.assertEqual([b.unread_count for b in DefaultBoard.objects.get_all_visible_boards(self.account2)],
+                         [3, 1, 1])
+
+        for i in range(2, 6):
+            board = DefaultBoard(db_key="Board " + str(i))
+            board.save()
+            board.create_post("Subject", "Text", author_name="Tester")
+        self.make_posts(10)
+        more_queries, _ = self.count_queries(DefaultBoard.objects.mark_all_read, self.account)
+        self.assertEqual(queries, more_queries)
+        self.assertEqual(sum(b.unread_count for b in DefaultBoard.objects.get_all_visible_boards(self.account)), 0)
+
+    def test_board_summary(self):
+        self.make_posts(3)
+        posts = list(self.board.posts(self.account))
+        posts[0].mark_read(self.account, True)
+
+        empty = DefaultBoard(db_key="Empty")
+        empty.save()
+
+        boards = DefaultBoard.objects.get_all_visible_boards(self.account)
+        self.assertEqual([(b.name, b.unread_count, b.total_count) for b in boards],
+                         [("Announcements", 2, 3), ("Empty", 0, 0)])
+        self.assertEqual(boards[0].last_post, posts[-1])
+        self.assertIsNone(boards[1].last_post)
+
+    def test_board_summary_query_count(self):
+        self.make_posts(3)
+        small, _ = self.count_queries(DefaultBoard.objects.get_all_visible_boards, self.account)
+
+        for i in range(3):
+            board = DefaultBoard(db_key="Board " + str(i))
+            board.save()
+            board.create_post("Subject", "Text", author_name="Tester")
+        self.make_posts(10)
+
+        large, boards = self.count_queries(DefaultBoard.objects.get_all_visible_boards, self.account)
+        self.assertEqual(len(boards), 4)
+        self.assertEqual(small, large)
+
+    def test_board_context(self):
+        self.make_posts(3)
+        other = DefaultBoard(db_key="Another Board")
+        other.save()
+        other.set_subscribed(self.account, True)
+
+        context = BoardContext(self.account)
+        queries, board = self.count_queries(context.find, "ann")
+        self.assertEqual(board, self.board)
+        self.assertEqual(queries, 1)
+
+        # Finding more boards, by name or number, reuses the boards already loaded.
+        queries, _ = self.count_queries(lambda: (context.find("2"), context.find("Nothing"), context.find("3")))
+        self.assertEqual(queries, 0)
+        self.assertEqual(context.find("1"), self.board)
+        self.assertIsNone(context.find("a"))
+        self.assertFalse(hasattr(board, "unread_count"))
+
+        boards = context.summarized
+        self.assertEqual([(b.name, b.unread_count, b.total_count) for b in boards],
+                         [("Announcements", 3, 3), ("Another Board", 0, 0)])
+        self.assertIs(boards[0], board)
+        self.assertEqual([context.is_subscribed(b) for b in boards], [False, True])
+
+    def test_unread_counts(self):
+        self.make_posts(3)
+        counts = lambda: [b.unread_count for b in DefaultBoard.objects.get_all_visible_boards(self.account)]
+        marker = lambda: ReadMarker.objects.marker(self.account, self.board)
+
+        self.assertEqual(counts(), [3])
+        self.assertEqual(marker().db_unread_count, 3)
+
+        posts = list(self.board.posts(self.account))
+        with patch.object(type(self.account), 'msg') as msg:
+            posts[0].mark_read(self.account, True)
+            posts[0].mark_read(self.account, True)
+            msg.assert_called_once_with(bboard_unread={"Announcements": 2}, session=None)
+        posts[2].mark_read(self.account, False)
+        self.assertEqual(counts(), [2])
+        posts[1].mark_read(self.account, True)
+        posts[1].mark_read(self.account, False)
+        self.assertEqual(counts(), [2])
+
+        with patch.object(SESSIONS, 'all_connected_accounts', return_value=[self.account, self.account2]), \
+                patch.object(type(self.account), 'msg') as msg:
+            self.make_posts(2)
+            self.board.create_post("Mine", "Text", author_player=self.account)
+            self.assertEqual(msg.call_args_list[-1][1]['bboard_unread'], {"Announcements": 4})
+        self.assertEqual(counts(), [4])
+
+        # The running count only skips the counting, so it always agrees with a fresh count.
+        ReadMarker.objects.forget_unread_counts(self.board)
+        self.assertIsNone(marker().db_unread_count)
+        self.assertEqual(counts(), [4])
+        self.assertEqual([b.unread_count for b in DefaultBoard.objects.get_all_visible_boards(self.account2)], [6])
+
+        self.board.mark_all_read(self.account)
+        self.assertEqual(marker().db_unread_count, 0)
+        self.assertEqual(counts(), [0])
+
+        # A post isn't part of the counts until the pipeline has counted it, so reading it first
+        # doesn't throw them off.
+        with patch('paxboards.pipeline.delay'):
+            post = self.board.create_post("Early", "Text", author_name="Tester")
+            post.mark_read(self.account, True)
+            self.assertEqual(marker().db_unread_count, 0)
+            PIPELINE.drain()
+        self.assertEqual(marker().db_unread_count, 0)
+        self.assertEqual(counts(), [0])
+
+        # Players who can no longer read the board aren't told about new posts, and their counts
+        # are dropped rather than kept.
+        can_read = lambda board, player, **kwargs: player.id != self.account2.id
+        with patch.object(SESSIONS, 'all_connected_accounts', return_value=[self.account, self.account2]), \
+                patch.object(DefaultBoard, 'access', autospec=True, side_effect=can_read), \
+                patch.object(type(self.account), 'msg', autospec=True) as msg:
+            self.make_posts(1)
+            self.assertEqual([call[0][0].id for call in msg.call_args_list], [self.account.id])
+        self.assertEqual(marker().db_unread_count, 1)
+        self.assertIsNone(ReadMarker.objects.marker(self.account2, self.board).db_unread_count)
+        self.board.mark_all_read(self.account)
+
+        # On a board with a post limit, posts which drop off to make room for new ones are taken
+        # off the counts, and reading them afterwards doesn't change the counts.
+        self.board.db_expiry_maxposts = 3
+        self.board.save()
+        ReadMarker.objects.forget_unread_counts(self.board)
+        self.assertEqual(counts(), [0])
+        self.make_posts(1)
+        dropping = list(self.board.posts())[-1]
+        self.make_posts(3)
+        self.assertEqual(marker().db_unread_count, 3)
+        dropping.mark_read(self.account, True)
+        self.assertEqual(marker().db_unread_count, 3)
+        ReadMarker.objects.forget_unread_counts(self.board)
+        self.assertEqual(counts(), [3])
+
+        # Boards with an age limit are always counted afresh.
+        self.board.db_expiry_maxposts = None
+        self.board.db_expiry_duration = 30
+        self.board.save()
+        ReadMarker.objects.forget_unread_counts(self.board)
+        self.make_posts(1)
+        self.assertIsNone(marker().db_unread_count)
+        self.assertEqual(counts(), [4])
+        self.assertIsNone(marker().db_unread_count)
+
+    def test_access_cache(self):
+        ACCESS_CACHE.clear()
+        with patch.object(TypedObject, 'access', return_value=True) as check:
+            hits, misses = ACCESS_CACHE.hits, ACCESS_CACHE.misses
+            self.assertTrue(self.board.access(self.account, 'read', default=True))
+            self.assertTrue(self.board.access(self.account, 'read', default=True))
+            self.assertEqual(check.call_count, 1)
+            self.assertEqual((ACCESS_CACHE.hits - hits, ACCESS_CACHE.misses - misses), (1, 1))
+
+            # Different checks, and other accounts, aren't mixed up.
+            self.board.access(self.account, 'post', default=True)
+            self.board.access(self.account2, 'read', default=True)
+            self.assertEqual(check.call_count, 3)
+
+            # Saving the board (as changing its locks does) forgets its results.
+            self.board.save()
+            self.board.access(self.account, 'read', default=True)
+            self.assertEqual(check.call_count, 4)
+
+            with override_settings(PAXBOARDS_ACCESS_TTL=0):
+                self.board.access(self.account2, 'post', default=True)
+            self.board.access(self.account2, 'post', default=True)
+            self.assertEqual(check.call_count, 6)
+
+            # Only saving boards, accounts and objects forgets results; posts are saved all the time.
+            self.assertFalse(post_save.has_listeners(Post))
+            self.assertTrue(post_save.has_listeners(DefaultBoard))
+            self.board.create_post("Subject", "Text", author_name="Tester")
+            self.board.access(self.account, 'read', default=True)
+            self.assertEqual(check.call_count, 6)
+
+            # Nor do saves of other fields, such as a Character moving, but a change of puppeteer
+            # does.
+            self.board.access(self.char1, 'read', default=True)
+            self.char1.save(update_fields=['db_location'])
+            self.board.access(self.char1, 'read', default=True)
+            self.assertEqual(check.call_count, 7)
+            self.char1.save(update_fields=['db_account'])
+            self.board.access(self.char1, 'read', default=True)
+            self.assertEqual(check.call_count, 8)
+
+    def test_access_cache_size(self):
+        ACCESS_CACHE.clear()
+        with patch.object(TypedObject, 'access', return_value=True), \
+                patch('paxboards.access.ACCESS_CACHE_SIZE', 2):
+            self.board.access(self.account, 'read', default=True)
+            with override_settings(PAXBOARDS_ACCESS_TTL=0):
+                self.board.access(self.account2, 'read', default=True)
+
+            # A full cache drops expired results first, then everything if that isn't enough.
+            self.board.access(self.char1, 'read', default=True)
+            self.assertEqual(len(ACCESS_CACHE.entries), 2)
+            self.assertIsNone(ACCESS_CACHE.entries.get(ACCESS_CACHE.accessor_key(self.account2)))
+
+            self.board.access(self.obj1, 'read', default=True)
+            self.assertEqual(len(ACCESS_CACHE.entries), 1)
+
+    def test_thread_summary(self):
+        self.make_posts(2)
+        first, second = list(self.board.posts())
+        reply = self.board.create_post("Re: Subject 0", "Reply", author_name="Replier", parent=first)
+
+        threads = list(self.board.threads(self.account))
+        self.assertEqual(threads, [first, second])
+        self.assertEqual((threads[0].total_posts, threads[0].last_poster, threads[0].is_unread), (2, "Replier", True))
+
+        reply.mark_read(self.account, True)
+        self.assertFalse(list(self.board.threads(self.account))[0].is_unread)
+
+        self.board.delete_post(reply)
+        threads = list(self.board.threads(self.account))
+        self.assertEqual(threads[0].total_posts, 1)
+        self.assertEqual(threads[0].last_poster, "Tester")
+
+    def test_thread_list_query_count(self):
+        self.make_posts(2)
+        small, _ = self.count_queries(lambda: list(self.board.threads(self.account)))
+        for post in list(self.board.posts()):
+            self.board.create_post("Re: Subject", "Reply", author_name="Replier", parent=post)
+        self.make_posts(10)
+        large, threads = self.count_queries(lambda: list(self.board.threads(self.account)))
+        self.assertEqual(len(threads), 12)
+        self.assertEqual(small, large)
+
+    def test_post_num(self):
+        self.make_posts(5)
+        posts = list(self.board.posts())
+        posts[3].db_pinned = True
+        posts[3].save()
+
+        posts = list(self.board.posts())
+        self.assertEqual([p.post_num for p in posts], [1, 2, 3, 4, 5])
+        self.assertEqual(posts[0].db_subject, "Subject 3")
+
+        self.board.db_expiry_maxposts = 3
+        self.board.save()
+        posts = list(Post.objects.filter(pk__in=[p.id for p in posts]).order_by('-db_pinned', 'id'))
+        self.assertEqual([p.post_num for p in posts], [1, None, None, 2, 3])
+
+    def test_post_num_query_count(self):
+        self.make_posts(3)
+        small, _ = self.count_queries(lambda: self.board.posts().last().post_num)
+        self.make_posts(30)
+        large, post_num = self.count_queries(lambda: self.board.posts().last().post_num)
+        self.assertEqual(post_num, 33)
+        self.assertEqual(small, large)
+
+    def test_keyset_paging(self):
+        self.make_posts(7)
+        posts = list(self.board.posts())
+        posts[4].db_pinned = True
+        posts[4].save()
+        self.board.create_post("Re: Subject 2", "Reply", author_name="Replier", parent=posts[2])
+
+        for queryset in [self.board.threads(self.account), Post.objects.filter(db_board=self.board).order_by('id')]:
+            expected = list(queryset)
+            pages = []
+            page = list(queryset[:3])
+            while page:
+                pages.extend(page)
+                page = list(queryset.after(page[-1])[:3])
+            self.assertEqual(pages, expected)
+
+            pages = []
+            page = list(queryset.reverse()[:3])
+            while page:
+                pages.extend(page)
+                page = list(queryset.before(page[-1]).reverse()[:3])
+            self.assertEqual(pages, expected[::-1])
+
+        small, _ = self.count_queries(lambda: list(self.board.threads().after(posts[1])[:3]))
+        self.make_posts(20)
+        large, _ = self.count_queries(lambda: list(self.board.threads().after(posts[1])[:3]))
+        self.assertEqual(small, large)
+
+    def test_rendered_cache(self):
+        post = self.board.create_post("Subject", "Some **bold** text", author_name="Tester")
+        expected = MarkdownParser(post.db_text).as_mush()
+        self.assertEqual(markdown.as_mush(post.db_text, key=post.render_key), expected)
+
+        with patch('markdown.cache.MarkdownParser') as parser:
+            self.assertEqual(markdown.as_mush(post.db_text, key=post.render_key), expected)
+            self.assertFalse(parser.called)
+
+        post.db_text = "Some _other_ text"
+        post.save()
+        self.assertEqual(markdown.as_mush(post.db_text, key=post.render_key), MarkdownParser(post.db_text).as_mush())
+        self.assertEqual(markdown.as_html("Some **bold** text"), MarkdownParser("Some **bold** text").as_html())
+
+    def test_post_pipeline(self):
+        PIPELINE.drain()
+        runs = dict((name, timing['runs']) for name, timing in PIPELINE.report().items())
+
+        # Hold the queued stages, as they would be until the reactor's next pass.
+        with patch('paxboards.pipeline.delay'), \
+                patch('utils.notifications.Notification.send_as_notification') as send:
+            post = self.board.create_post("Subject", "Some **bold** text", author_name="Tester")
+            self.assertEqual(PIPELINE.backlog, 1)
+            self.assertFalse(send.called)
+
+            PIPELINE.drain()
+            self.assertEqual(PIPELINE.backlog, 0)
+            self.assertEqual(send.call_count, 1)
+            self.assertIn("(Announcements/1)", send.call_args[0][0])
+
+        with patch('markdown.cache.MarkdownParser') as parser:
+            markdown.as_mush(post.db_text, key=post.render_key)
+            self.assertFalse(parser.called)
+
+        report = PIPELINE.report()
+        for name in ('count', 'number', 'announce', 'render', 'total'):
+            self.assertEqual(report[name]['runs'], runs[name] + 1)
+
+        # A failed stage is logged, and the post's later stages are skipped.
+        failing = [(name, (lambda post, context: 1 / 0) if name == 'number' else stage)
+                   for name, stage in PIPELINE.stages]
+        with patch('paxboards.pipeline.delay'), patch('paxboards.pipeline.logger') as logger, \
+                patch.object(PIPELINE, 'stages', failing), \
+                patch('utils.notifications.Notification.send_as_notification') as send:
+            self.board.create_post("Subject", "Text", author_name="Tester")
+            PIPELINE.drain()
+            self.assertTrue(logger.log_trace.called)
+            self.assertFalse(send.called)
+        self.assertEqual(PIPELINE.report()['number']['failures'], report['number']['failures'] + 1)
+
+    def test_expiry_matches_model(self):
+        rng = random.Random(1066)
+        now = timezone.now()
+
+        for _ in range(40):
+            Post.objects.filter(db_board=self.board).delete()
+            self.make_posts(rng.randint(0, 25))
+
+            posts = []
+            ids = list(Post.objects.filter(db_board=self.board).order_by('id').values_list('id', flat=True))
+            ages = sorted((rng.randint(0, 60) * 3600 * 12 for _ in ids), reverse=True)
+            for pk, age in zip(ids, ages):
+                date = now - timedelta(seconds=age) + timedelta(microseconds=pk)
+                pinned = rng.random() < 0.2
+                Post.objects.filter(pk=pk).update(db_date_created=date, db_pinned=pinned)
+                posts.append((pk, date, pinned))
+
+            self.board.db_expiry_maxposts = rng.choice([None, rng.randint(1, 20)])
+            self.board.db_expiry_duration = rng.choice([None, rng.randint(1, 30)])
+
+            actual = list(Post.objects.posts(self.board).values_list('id', flat=True))
+            self.assertEqual(actual, expected_by_board(posts, self.board, timezone.now()))
+
+    def test_expiry_tied_dates(self):
+        self.make_posts(6)
+        ids = list(Post.objects.filter(db_board=self.board).order_by('id').values_list('id', flat=True))
+        now = timezone.now()
+        dates = [now - timedelta(days=2)] + [now - timedelta(days=1)] * 4 + [now]
+        for pk, date in zip(ids, dates):
+            Post.objects.filter(pk=pk).update(db_date_created=date)
+
+        # The limit falls in the middle of four posts made at the same moment.
+        self.board.db_expiry_maxposts = 3
+        self.board.save()
+        self.assertEqual(list(Post.objects.posts(self.board).values_list('id', flat=True)), ids[3:])
+        self.assertEqual(Post.objects.get(pk=ids[3]).post_num, 1)
+        self.assertIsNone(Post.objects.get(pk=ids[2]).post_num)
+
+        rng = random.Random(1066)
+        for _ in range(40):
+            posts = []
+            for pk in ids:
+                pinned = rng.random() < 0.2
+                Post.objects.filter(pk=pk).update(db_pinned=pinned)
+                posts.append((pk, Post.objects.get(pk=pk).db_date_created, pinned))
+
+            self.board.db_expiry_maxposts = rng.randint(1, 6)
+            actual = list(Post.objects.posts(self.board).values_list('id', flat=True))
+            self.assertEqual(actual, expected_by_board(posts, self.board, timezone.now()))
+
+    def test_parse_query(self):
+        self.assertEqual(parse_query('game subject:night poster:"Pax Dancer" "by the sea" http://x'),
+                         [(None, 'game', False), ('subject', 'night', False), ('poster', 'Pax Dancer', True),
+                          (None, 'by the sea', True), (None, 'http://x', False)])
+        self.assertEqual(parse_query('  ""  '), [])
+
+    def make_search_posts(self):
+        self.board.create_post("Game night", "Cards by the sea.", author_name="Pax")
+        self.board.create_post("Meeting", "Game night is cancelled; the sea was rough.", author_name="Dancer")
+        self.board.create_post("Re: Meeting", "Night games by the fire.", author_name="Pax")
+        other = DefaultBoard(db_key="Other")
+        other.save()
+        other.create_post("Game night", "Elsewhere.", author_name="Pax")
+
+    def search_subjects(self, backend, searchstring):
+        return sorted(p.db_subject for p in backend.search(Post.objects.posts(self.board), searchstring))
+
+    def test_search(self):
+        self.make_search_posts()
+        for backend in [get_backend(), SearchBackend()]:
+            self.assertEqual(self.search_subjects(backend, "game night"), ["Game night", "Meeting", "Re: Meeting"])
+            self.assertEqual(self.search_subjects(backend, "subject:game"), ["Game night"])
+            self.assertEqual(self.search_subjects(backend, "poster:pax sea"), ["Game night"])
+            self.assertEqual(self.search_subjects(backend, '"by the sea"'), ["Game night"])
+            self.assertEqual(self.search_subjects(backend, ""), [])
+
+        self.assertEqual(Post.objects.search("game night", self.board).first().db_subject, "Game night")
+        self.assertEqual(Post.objects.search("game night").count(), 4)
+        self.assertEqual(Post.objects.search("game night", self.board).count(), 3)
+        self.assertEqual(Post.objects.search("game night", boards=[]).count(), 0)
+
+    def test_search_positions(self):
+        self.make_search_posts()
+        self.board.create_post("Pinned", "Game night rules.", author_name="Pax")
+        pinned = Post.objects.get(db_subject="Pinned")
+        pinned.db_pinned = True
+        pinned.save()
+        self.make_posts(2)
+
+        boards = list(DefaultBoard.objects.all())
+        for board in boards:
+            board.db_expiry_maxposts = 5
+            board.save()
+
+        # Results are numbered as they are on their boards, in one query however many there are.
+        queries, results = self.count_queries(
+            lambda: list(Post.objects.search("game night", boards=boards).with_positions(boards)))
+        self.assertEqual(len(results), 4)
+        self.assertEqual(sorted((p.db_subject, p.position) for p in results),
+                         sorted((p.db_subject, p.post_num) for p in results))
+        self.assertEqual(queries, 1)
+        self.assertEqual(dict((p.db_subject, p.position) for p in results if p.db_board == self.board),
+                         {"Pinned": 1, "Meeting": 2, "Re: Meeting": 3})
+
+    def test_search_backend_available(self):
+        # Without the index, such as when SQLite wasn't built with FTS5, searches scan instead.
+        with patch.object(FTSSearchBackend, 'table', 'paxboards_missing_fts'):
+            self.assertFalse(FTSSearchBackend.available(connection))
+
+    def test_search_index_sync(self):
+        self.make_search_posts()
+        post = Post.objects.search("poster:dancer", self.board).get()
+        post.db_text = "Rescheduled to Tuesday."
+        post.save()
+        self.assertEqual(list(Post.objects.search("tuesday", self.board)), [post])
+        self.assertEqual(Post.objects.search('"was rough"', self.board).count(), 0)
+
+        post.delete()
+        self.assertEqual(Post.objects.search("tuesday", self.board).count(), 0)
+
+
+class TestQueryPlans(EvenniaTest):
+    """
+    Checks that the queries behind PostManager are served by indexes rather than
+    scanning whole tables.  This relies on SQLite's EXPLAIN QUERY PLAN.
+    """
+
+    table_scan = re.compile(r"^SCAN (TABLE )?(?!SUBQUERY)\w+\b(?! VIRTUAL TABLE)")
+
+    def setUp(self):
+        super(TestQueryPlans, self).setUp()
+        if connection.vendor != 'sqlite':
+            self.skipTest("Query plans are only checked on SQLite.")
+
+        self.board = DefaultBoard(db_key="Announcements", db_expiry_maxposts=10, db_expiry_duration=30)
+        self.board.save()
+        self.post = self.board.create_post("Subject", "Text", author_name="Tester", author_player=self.account)
+        self.board.create_post("Re: Subject", "Reply", author_name="Tester", parent=self.post)
+
+    def assertNoTableScans(self, func, *args):
+        with CaptureQueriesContext(connection) as context:
+            result = func(*args)
+            if hasattr(result, 'query'):
+                list(result)
+
+        cursor = connection.cursor()
+        for query in context.captured_queries:
+            if not query['sql'].startswith("SELECT"):
+                continue
+
+            cursor.execute("EXPLAIN QUERY PLAN " + query['sql'])
+            for row in cursor.fetchall():
+                if self.table_scan.match(row[-1]):
+                    self.fail("Table scan (" + row[-1] + ") in query: " + query['sql'])
+
+    def test_post_manager_plans(self):
+        self.assertNoTableScans(Post.objects.post, self.post.id)
+        self.assertNoTableScans(Post.objects.posts, self.board)
+        self.assertNoTableScans(Post.objects.posts, self.board, self.account)
+        self.assertNoTableScans(Post.objects.threads, self.board)
+        self.assertNoTableScans(Post.objects.threads, self.board, self.account)
+        self.assertNoTableScans(lambda: list(Post.objects.threads(self.board).after(self.post)[:10]))
+        self.assertNoTableScans(Post.objects.search, "Text", self.board)
+        self.assertNoTableScans(Post.objects.search, 'subject:"Re: Subject"')
+        self.assertNoTableScans(lambda: self.post.post_num)
+        self.assertNoTableScans(lambda: list(Post.objects.filter(db_parent=self.post).order_by('db_date_created')))
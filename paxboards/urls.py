@@ -1,10 +1,11 @@
 # URL patterns for the paxboards app
 
 from django.conf.urls import url
-from paxboards.views import show_boardlist, show_board, show_thread, submit_post, submit_reply
+from paxboards.views import show_boardlist, show_board, show_search, show_thread, submit_post, submit_reply
 
 urlpatterns = [
     url(r'^$', show_boardlist, name="boardlist"),
+    url(r'^search/$', show_search, name="search"),
     url(r'^(?P<board_id>\d+)/$', show_board, name="board"),
     url(r'^(?P<board_id>\d+)/(?P<post_id>\d+)/$', show_thread, name="thread"),
     url(r'^(?P<board_id>\d+)/post/$', submit_post, name="post"),
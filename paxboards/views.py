@@ -3,7 +3,64 @@ from django.http import Http404, HttpResponseRedirect
 from boards import DefaultBoard
 from models import Post
 from evennia.utils import ansi
+from markdown import cache as markdown
 from forms import PostForm, ReplyForm
+from board_utils import posts_per_page
+from utils.notifications import Notification
+
+# Page sizes for players who haven't set a display height.
+THREADS_PER_PAGE = 25
+REPLIES_PER_PAGE = 25
+SEARCH_RESULTS = 50
+
+
+def page_size(account, default):
+    """
+    Works out how many threads or replies to show on a page from the display height the player
+    has set in game (see 'help display'), the same way bboard listings are sized.
+
+    Args:
+        account: The player viewing the page.
+        default: The page size to use if they haven't set a height.
+
+    Returns:
+        The number of threads or replies on a page.
+
+    """
+    # Display settings are usually made while puppeting, so they're kept on the Character.
+    height = Notification.config(account, "height")
+    if not height and account.db._last_puppet:
+        height = Notification.config(account.db._last_puppet, "height")
+
+    return posts_per_page(height) if height else default
+
+
+def keyset_page(posts, after, count):
+    """
+    Gets one page of posts, continuing from the post whose id is given in 'after'.  Posts
+    are found by their place in the ordering rather than by offset, so deep pages are as
+    cheap as the first.
+
+    Args:
+        posts: An ordered PostQuerySet.
+        after: The id of the last post on the previous page, or None for the first page.
+        count: The number of posts on a page.
+
+    Returns:
+        A tuple of the list of posts on this page, and the id to continue from for the next
+        page (or None if this is the last page).
+
+    """
+    if after and after.isdigit():
+        last = posts.filter(pk=after).first()
+        if last:
+            posts = posts.after(last)
+
+    page = list(posts[:count + 1])
+    if len(page) > count:
+        return page[:count], page[count - 1].id
+
+    return page, None
 
 
 def show_boardlist(request):
@@ -28,10 +85,12 @@ def show_board(request, board_id):
 
         can_post = board.access(request.user, access_type="post", default=True)
 
-        threads = board.threads(request.user)
+        after = request.GET.get('after')
+        threads, next_after = keyset_page(board.threads(request.user), after,
+                                          page_size(request.user, THREADS_PER_PAGE))
 
-        context = {'board': board, 'threads': threads, 'can_post': can_post,
-                   'board_id': board.id, 'page_title': 'Forums - ' + board.name}
+        context = {'board': board, 'threads': threads, 'can_post': can_post, 'after': after,
+                   'next_after': next_after, 'board_id': board.id, 'page_title': 'Forums - ' + board.name}
 
         return render(request, 'board.html', context)
 
@@ -39,6 +98,32 @@ def show_board(request, board_id):
         return render(request, 'board_noperm.html', {})
 
 
+def show_search(request):
+    if not request.user.is_authenticated or request.user.username == "":
+        return render(request, 'login.html', {})
+
+    searchstring = request.GET.get('q', '').strip()
+    boards = DefaultBoard.objects.get_readable_boards(request.user)
+
+    board = None
+    board_id = request.GET.get('board')
+    if board_id:
+        board = next((b for b in boards if str(b.id) == board_id), None)
+        if not board:
+            return render(request, 'board_noperm.html', {})
+
+    posts = []
+    if searchstring:
+        if board:
+            posts = Post.objects.search(searchstring, board)[:SEARCH_RESULTS]
+        else:
+            posts = Post.objects.search(searchstring, boards=boards)[:SEARCH_RESULTS]
+
+    context = {'board': board, 'posts': posts, 'searchstring': searchstring,
+               'page_title': 'Forums - Search'}
+    return render(request, 'search.html', context)
+
+
 def show_thread(request, board_id, post_id):
     if not request.user.is_authenticated or request.user.username == "":
         return render(request, 'login.html', {})
@@ -52,19 +137,19 @@ def show_thread(request, board_id, post_id):
 
         can_post = board.access(request.user, access_type="post", default=False)
 
-        plaintext = ansi.strip_ansi(post.db_text)
-        setattr(post, 'plaintext', plaintext)
+        setattr(post, 'rendered', markdown.as_html(ansi.strip_ansi(post.db_text), key=post.render_key))
         post.mark_read(request.user, True)
 
-        replies = Post.objects.filter(db_parent=post).order_by('db_date_created')
+        after = request.GET.get('after')
+        replies = Post.objects.filter(db_parent=post).order_by('db_date_created', 'id')
+        replies, next_after = keyset_page(replies, after, page_size(request.user, REPLIES_PER_PAGE))
         for r in replies:
-            plaintext = ansi.strip_ansi(r.db_text)
-            setattr(r, 'plaintext', plaintext)
+            setattr(r, 'rendered', markdown.as_html(ansi.strip_ansi(r.db_text), key=r.render_key))
             r.mark_read(request.user, True)
 
         form = ReplyForm()
         context = {'board': board, 'post': post, 'replies': replies, 'can_post': can_post,
-                   'board_id': board, 'post_id': post, 'form': form,
+                   'after': after, 'next_after': next_after, 'board_id': board, 'post_id': post, 'form': form,
                   'page_title': 'Forums - ' + post.db_subject}
 
         return render(request, 'thread.html', context)
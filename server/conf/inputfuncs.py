@@ -50,3 +50,25 @@ as argument.
 #
 #     """
 #     pass
+
+
+def bboard_unread(session, *args, **kwargs):
+    """
+    Sends the client how many unread posts there are on every board the account can read, as a
+    'bboard_unread' message.  Clients only need to ask once, such as when they connect; after
+    that, changes are sent as they happen.
+
+    Args:
+        session (Session): The Session asking.
+        args, kwargs (any): Ignored.
+
+    """
+    account = session.get_account()
+    if not account:
+        return
+
+    from paxboards.boards import DefaultBoard
+    from paxboards.models import send_unread_counts
+
+    boards = DefaultBoard.objects.get_all_visible_boards(account)
+    send_unread_counts(account, [(board, board.unread_count) for board in boards], session=session)
@@ -22,6 +22,7 @@ settings file:
 """
 
 from evennia.server.serversession import ServerSession as BaseServerSession
+from utils.presence import PRESENCE
 
 
 class ServerSession(BaseServerSession):
@@ -33,4 +34,11 @@ class ServerSession(BaseServerSession):
     to the game server. All communication between game and account goes
     through their session(s).
     """
-    pass
+
+    def at_login(self, account):
+        super(ServerSession, self).at_login(account)
+        PRESENCE.connect(self)
+
+    def at_disconnect(self, reason=None):
+        PRESENCE.disconnect(self)
+        super(ServerSession, self).at_disconnect(reason)
@@ -47,6 +47,21 @@ INSTALLED_APPS = INSTALLED_APPS + (
 TIME_ZONE = 'America/Los_Angeles'
 EVENNIA_ADMIN = False
 
+# Our session class keeps the who list's snapshot of who's online up to date.
+SERVER_SESSION_CLASS = "server.conf.serversession.ServerSession"
+
+# Rendered Markdown (bboard posts and the like) gets a cache of its own, so it can't push
+# anything else out.  A memcached backend here will evict least-recently-used renderings.
+CACHES = dict(globals().get('CACHES') or {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+CACHES['markdown'] = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'markdown',
+    'TIMEOUT': None,
+    'OPTIONS': {'MAX_ENTRIES': 2000},
+}
+
 ######################################################################
 # Settings given in secret_settings.py override those in this file.
 ######################################################################
@@ -8,6 +8,7 @@ creation commands.
 
 """
 from evennia import DefaultCharacter
+from utils.presence import PRESENCE
 import time
 
 class Character(DefaultCharacter):
@@ -31,6 +32,19 @@ class Character(DefaultCharacter):
 
     """
 
+    def at_post_puppet(self, **kwargs):
+        super(Character, self).at_post_puppet(**kwargs)
+        PRESENCE.refresh_account(self.account)
+        PRESENCE.place(self, self.location)
+
+    def save(self, *args, **kwargs):
+        super(Character, self).save(*args, **kwargs)
+        # Setting location saves just db_location, so this catches every move, including those
+        # made without move hooks.
+        update_fields = kwargs.get('update_fields')
+        if (update_fields is None or 'db_location' in update_fields) and self.sessions.count():
+            PRESENCE.place(self, self.location)
+
     def at_post_unpuppet(self, player, session=None, **kwargs):
         """
         We stove away the character when the player goes ooc/logs off,
@@ -44,3 +58,5 @@ class Character(DefaultCharacter):
         super(Character, self).at_post_unpuppet(player, session)
         if not self.sessions.count():
             self.db.last_logout = time.time()
+            PRESENCE.place(self, None)
+        PRESENCE.refresh_account(player)
@@ -0,0 +1,133 @@
+"""
+Benchmarks for notification delivery.
+
+These are not part of the normal test run.  To run them, use:
+
+    evennia test utils.benchmarks
+
+"""
+from __future__ import print_function
+
+import random
+import time
+
+from django.test import SimpleTestCase
+
+from utils.notifications import Notification, NotificationPrefs
+from utils.tests import FakeCharacter
+from utils.text import display_width
+
+SUBSCRIBERS = 1000
+NOTIFICATION_LINES = (10, 2000)
+REPEATS = 10
+
+
+def make_subscribers(count, rng):
+    """
+    Builds a set of subscribers with a realistic mix of preferences: most use the defaults,
+    some have a prefix or width set, a few ignore board notifications, and a good share aren't
+    connected at all.
+
+    :param count: How many subscribers to make.
+    :param rng: The random.Random to choose preferences with.
+    :return: A list of FakeCharacters.
+    """
+    subscribers = []
+    for _ in range(count):
+        prefs = {}
+        roll = rng.random()
+        if roll < 0.2:
+            prefs["prefixes"] = {"board": rng.choice(["|c[BB]|n ", "|y<Board>|n "])}
+        elif roll < 0.3:
+            prefs["width"] = rng.choice([60, 100])
+        elif roll < 0.35:
+            prefs["ignored"] = ["board"]
+
+        subscribers.append(FakeCharacter(prefs, rng.random() < 0.6, rng.choice([80, 120])))
+
+    return subscribers
+
+
+def measure(func, subscribers, repeats=REPEATS):
+    """
+    Sends to a set of subscribers several times, tracking how long it takes and how often
+    their preferences are read.  Cached preferences are dropped before each send, as if the
+    subscribers had just connected.
+
+    :param func: A function taking the list of subscribers, which sends to them.
+    :param subscribers: The subscribers.
+    :param repeats: How many times to send.
+    :return: A tuple of (preference reads per send, average seconds per send).
+    """
+    for subscriber in subscribers:
+        subscriber.db.reads = 0
+
+    elapsed = 0
+    for _ in range(repeats):
+        for subscriber in subscribers:
+            NotificationPrefs.invalidate(subscriber)
+
+        start = time.time()
+        func(subscribers)
+        elapsed += time.time() - start
+
+    return sum(subscriber.db.reads for subscriber in subscribers) // repeats, elapsed / repeats
+
+
+class BenchmarkNotifications(SimpleTestCase):
+
+    def test_board_fan_out(self):
+        text = "New post by |555Benchmark:|n (Announcements/42): |555Fan-out benchmark|n"
+
+        def one_at_a_time(subscribers):
+            for subscriber in subscribers:
+                Notification.msg(subscriber, text, style="announce", notification_type="board")
+
+        def batched(subscribers):
+            Notification.fan_out(text, subscribers, notification_type="board")
+
+        legacy = make_subscribers(SUBSCRIBERS, random.Random(1066))
+        grouped = make_subscribers(SUBSCRIBERS, random.Random(1066))
+
+        legacy_reads, legacy_time = measure(one_at_a_time, legacy)
+        grouped_reads, grouped_time = measure(batched, grouped)
+
+        # Both ways must deliver exactly the same thing to everyone.
+        for old, new in zip(legacy, grouped):
+            self.assertEqual([text for _, text in old.received], [text for _, text in new.received])
+
+        print()
+        print("%d subscribers, one at a time: %7.2f ms, %5d preference reads" %
+              (SUBSCRIBERS, legacy_time * 1000, legacy_reads))
+        print("%d subscribers, batched:       %7.2f ms, %5d preference reads" %
+              (SUBSCRIBERS, grouped_time * 1000, grouped_reads))
+
+    def test_render(self):
+        caller = FakeCharacter({"prefixes": {"general": "|c>|n "}}, True, 80)
+
+        print()
+        for count in NOTIFICATION_LINES:
+            bordered = Notification(caller, border=True, header="Benchmark", footer="Page 1")
+            response = Notification(caller, style="response", command="bench")
+            for i in range(count):
+                line = "Line %d of a long notification, |wwith|n some color in it." % i
+                bordered.add_line(line)
+                response.add_line(line)
+
+            start = time.time()
+            for _ in range(REPEATS):
+                str(bordered)
+                str(response)
+            elapsed = (time.time() - start) / (REPEATS * 2)
+
+            print("%4d line notification: %7.3f ms to render" % (count, elapsed * 1000))
+
+    def test_display_width(self):
+        title = "|w" + "Announcements and other things|n"
+        start = time.time()
+        for _ in range(REPEATS * 1000):
+            display_width(title)
+        elapsed = (time.time() - start) / (REPEATS * 1000)
+
+        print()
+        print("Measuring a remembered title: %7.4f ms" % (elapsed * 1000))
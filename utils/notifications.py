@@ -1,5 +1,114 @@
-from evennia.utils import ansi
+from collections import OrderedDict
+from evennia.utils.utils import delay
 from evennia.server.sessionhandler import SESSIONS
+from utils.text import display_width
+
+# How many distinct border lines to keep, before starting over.
+BORDER_CACHE_SIZE = 256
+
+_borders = {}
+
+
+def border(width, color, title=None, footer=False):
+    """
+    Builds the decorative line drawn above or below a bordered notification.  Border lines are
+    kept once built, since the same few widths, colors and titles come up over and over.
+
+    :param width: The width of the line.
+    :param color: The color code for the line.
+    :param title: The title to put in the line, if any.
+    :param footer: True if this is the line at the bottom of the notification.
+    :return: The border line.
+    """
+    key = (width, color, title, footer)
+    line = _borders.get(key)
+    if line is None:
+        if not title:
+            line = color + ("=" * width) + "|n"
+        else:
+            fill = "=" * (width - (display_width(title) + 9))
+            if footer:
+                line = color + fill + "|w[ " + title + " ]" + color + ("=" * 5) + "|n"
+            else:
+                line = color + ("=" * 5) + "|w[ " + title + " ]" + color + fill + "|n"
+
+        if len(_borders) >= BORDER_CACHE_SIZE:
+            _borders.clear()
+        _borders[key] = line
+
+    return line
+
+
+class NotificationPrefs(object):
+    """
+    A caller's notification preferences.  These are read from the caller's notification_prefs
+    attribute the first time they're needed, then kept on the caller's ndb so that rendering and
+    sending notifications doesn't go back to the attribute store; Notification.set_config drops
+    the copy whenever a preference changes.
+    """
+
+    __slots__ = ('prefs',)
+
+    # How many times preferences have been loaded from the attribute store.
+    reads = 0
+
+    def __init__(self, prefs):
+        self.prefs = prefs
+
+    @classmethod
+    def get_for(cls, caller):
+        """
+        Gets the preferences for a caller, loading them if they aren't already cached.
+
+        :param caller: The Character or Account whose preferences should be retrieved.
+        :return: A NotificationPrefs instance.
+        """
+        prefs = caller.ndb.notification_prefs
+        if prefs is None:
+            NotificationPrefs.reads += 1
+            prefs = cls(dict(caller.db.notification_prefs or {}))
+            caller.ndb.notification_prefs = prefs
+
+        return prefs
+
+    @classmethod
+    def invalidate(cls, caller):
+        """
+        Drops the cached preferences for a caller, so they'll be loaded again on next use.
+
+        :param caller: The Character or Account whose preferences have changed.
+        """
+        caller.ndb.notification_prefs = None
+
+    def __contains__(self, key):
+        return key in self.prefs
+
+    def get(self, key, default=None):
+        return self.prefs[key] if key in self.prefs else default
+
+    @property
+    def width(self):
+        return int(self.prefs["width"]) if "width" in self.prefs else None
+
+    @property
+    def height(self):
+        return int(self.prefs["height"]) if "height" in self.prefs else None
+
+    @property
+    def prefixes(self):
+        return self.prefs.get("prefixes") or {}
+
+    @property
+    def ignored(self):
+        return self.prefs.get("ignored") or []
+
+    @property
+    def border_color(self):
+        return self.prefs.get("border_color")
+
+    @property
+    def response_color(self):
+        return self.prefs.get("response_color")
 
 
 class Notification:
@@ -36,45 +145,31 @@ class Notification:
         self.width = width or self.get_config("width", default=78)
         self.style = style
         self.command = command
+        self.rendered = {}
 
     def __str__(self):
-        result = ""
-
         prefix = self.get_prefix()
         if self.style == "response":
             if self.command:
                 prefix = prefix + "|w" + self.command + ":|n "
 
             single_color = self.get_config("response_color") or "|n"
-
-            for line in self.lines:
-                result = "\n" + prefix + single_color + line
+            lead = "\n" + prefix + single_color
+            parts = self.lines
 
         else:
-            border_color = self.get_config("border_color", "|[B")
+            lead = "\n" + prefix
             if self.border:
-                result = "\n"
-                if not self.header_title:
-                    result = result + prefix + border_color + ("=" * self.width) + "|n"
-                else:
-                    raw_header = ansi.strip_ansi(self.header_title)
-                    line = border_color + ("=" * 5) + "|w[ " + self.header_title + " ]" + border_color
-                    line = line + "=" * (self.width - (len(raw_header) + 9))
-                    result = result + prefix + line + "|n"
+                border_color = self.get_config("border_color", "|[B")
+                parts = [border(self.width, border_color, self.header_title)] + self.lines + \
+                        [border(self.width, border_color, self.footer_title, footer=True)]
+            else:
+                parts = self.lines
 
-            for line in self.lines:
-                result = result + "\n" + prefix + line
+        if not parts:
+            return ""
 
-            if self.border:
-                if not self.footer_title:
-                    result = result + "\n" + prefix + border_color + ("=" * self.width) + "|n"
-                else:
-                    raw_footer = ansi.strip_ansi(self.footer_title)
-                    line = border_color + "=" * (self.width - (len(raw_footer) + 9))
-                    line = line + "|w[ " + self.footer_title + " ]" + border_color + ("=" * 5) + "|n"
-                    result = result + "\n" + prefix + line
-
-        return result
+        return lead + lead.join(parts)
 
     def get_prefix(self):
         """
@@ -92,21 +187,16 @@ class Notification:
         :param align: "left", "right", or "center" -- defaults to left
         """
 
-        temp_lines = text.split("\n")
-        if len(temp_lines) > 1:
-            for subline in temp_lines:
-                self.add_line(subline)
-        else:
-            line = text
-
+        for line in text.split("\n"):
             if align == "right":
-                line = " " * (self.width - len(ansi.strip_ansi(text))) + text
+                line = " " * (self.width - display_width(line)) + line
             elif align == "center":
-                padding = (self.width - len(ansi.strip_ansi(text))) / 2
-                line = " " * padding + line
+                line = " " * ((self.width - display_width(line)) / 2) + line
 
             self.lines.append(line)
 
+        self.rendered.clear()
+
     def add_divider(self, title=None):
         """
         Adds a divider line to the Notification instance.
@@ -116,38 +206,68 @@ class Notification:
             self.add_line("-" * self.width)
         else:
             self.add_line(("-" * 5) + "[ |w" + title + "|n ]" +
-                          ("-" * (self.width - (len(ansi.strip_ansi(title)) + 9))))
+                          ("-" * (self.width - (display_width(title) + 9))))
 
     def send(self, caller):
         """
         Sends to the given caller, with their customizations, if and only if
         they have not disabled the notifications in question.
 
+        If the caller is an Account, this goes to every one of its connected sessions, using the
+        preferences of whichever Character that session is puppeting (or the Account's own, if
+        it isn't puppeting anything).
+
         :param caller: The recipient of the message.
         """
         if not caller:
             return
 
-        # If this is an account, go to all their connected players
         if caller.is_typeclass("typeclasses.accounts.Account"):
             for session in caller.sessions.get():
-                self.send(session.get_puppet())
-                return
+                self.deliver(session.get_puppet() or caller, session=session)
+            return
 
-        self.caller = caller
+        self.deliver(caller)
+
+    def deliver(self, caller, session=None):
+        """
+        Sends this notification to a single recipient, rendered with their preferences, unless
+        they're ignoring notifications of this type.
+
+        :param caller: The Character or Account to send to.
+        :param session: If given, only this one of the caller's sessions gets the notification.
+        """
+        prefs = NotificationPrefs.get_for(caller)
+        if self.style != "response" and self.notification_type in prefs.ignored:
+            # We have this notification type set to ignore, so don't
+            # send anything
+            return
+
+        if session:
+            caller.msg(self.render_for(caller), session=session, type=self.notification_type)
+        else:
+            caller.msg(self.render_for(caller), type=self.notification_type)
 
-        if self.style is not "response":
-            ignores = self.get_config("ignored", default=[])
+    def render_for(self, caller):
+        """
+        Renders this notification with the given caller's preferences.  Each rendering is kept,
+        so sending to several sessions or callers who'd see the same thing only renders once.
+
+        :param caller: The Character or Account it's being rendered for.
+        :return: The rendered notification.
+        """
+        prefs = NotificationPrefs.get_for(caller)
+        profile = (self.width, prefs.prefixes.get(self.notification_type, ""), prefs.response_color,
+                   prefs.border_color)
 
-            if self.notification_type in ignores:
-                # We have this notification type set to ignore, so don't
-                # send anything
-                return
+        if profile not in self.rendered:
+            self.caller = caller
+            self.rendered[profile] = str(self)
 
-        self.caller.msg(str(self), type=self.notification_type)
+        return self.rendered[profile]
 
     @classmethod
-    def send_as_notification(cls, text, list=None, notification_type="general", style="announce"):
+    def send_as_notification(cls, text, list=None, notification_type="general", style="announce", deferred=False):
         """
         For every connected session, sends this to any Character they're using
         that hasn't ignored this notification.  Do this so we get the Character's
@@ -157,18 +277,98 @@ class Notification:
 
         :param text: The text to send.
         :param list: A list of specific Characters or Accounts to send to, optional.
+        :param deferred: If True, the sending is done on the next pass of the reactor rather than
+                         right away, so a command with many recipients can finish first.
         """
-        if not list:
+        if list is None:
+            list = []
             for session in SESSIONS.get_sessions():
-                puppet = session.get_puppet()
-                if puppet:
-                    Notification.msg(puppet, text, style=style, notification_type=notification_type)
-                else:
-                    # Give up and send to the account, which won't have puppet prefs
-                    Notification.msg(session.get_account(), text, style=style, notification_type=notification_type)
+                # Sessions without a Character fall back to the account, which won't have puppet prefs
+                list.append(session.get_puppet() or session.get_account())
+
+        if deferred:
+            delay(0, cls.fan_out, text, list, notification_type=notification_type, style=style)
         else:
-            for recipient in list:
-                Notification.msg(recipient, text, style=style, notification_type=notification_type)
+            cls.fan_out(text, list, notification_type=notification_type, style=style)
+
+    @classmethod
+    def fan_out(cls, text, recipients, notification_type="general", style="announce"):
+        """
+        Sends a one-line notification to many recipients at once.  Recipients who aren't connected
+        are skipped before any of their preferences are read; everyone else is grouped by the
+        preferences that change how the notification looks, and each distinct version of the
+        notification is only formatted once.
+
+        :param text: The text to send.
+        :param recipients: The Characters or Accounts to send to.
+        :param notification_type: The class of notification, such as 'board'.
+        :param style: The notification style, as for a new Notification.
+        """
+        groups = OrderedDict()
+        seen = set()
+        for recipient in recipients:
+            for target, session in cls.resolve_recipient(recipient):
+                if session in seen:
+                    continue
+                seen.add(session)
+
+                profile = cls.profile(target, session, notification_type, style)
+                if profile is not None:
+                    groups.setdefault(profile, []).append((target, session))
+
+        for profile, targets in groups.iteritems():
+            notice = cls(targets[0][0], notification_type=notification_type, style=style, width=profile[1])
+            notice.add_line(text)
+            message = str(notice)
+            for target, session in targets:
+                target.msg(message, session=session, type=notification_type)
+
+    @classmethod
+    def resolve_recipient(cls, caller):
+        """
+        Works out who a notification for the given caller should actually go to.  Each of an
+        Account's sessions gets the notification as the Character it's using, so that the
+        Character's preferences apply, or as the Account if it isn't using one.
+
+        :param caller: A Character or Account.
+        :return: A list of (recipient, session) pairs, which is empty if nobody is connected.
+        """
+        if not caller:
+            return []
+
+        sessions = caller.sessions.get()
+        if caller.is_typeclass("typeclasses.accounts.Account"):
+            return [(session.get_puppet() or caller, session) for session in sessions]
+
+        return [(caller, session) for session in sessions]
+
+    @classmethod
+    def profile(cls, caller, session, notification_type, style):
+        """
+        Reads everything in a caller's preferences that affects how a notification is shown to
+        them, in a single read of their preferences.
+
+        :param caller: The recipient.
+        :param session: The recipient's session, used to find their screen width.
+        :param notification_type: The class of notification being sent.
+        :param style: The style of notification being sent.
+        :return: A (prefix, width, response color, border color) tuple, or None if the caller is
+                 ignoring notifications of this type.
+        """
+        prefs = NotificationPrefs.get_for(caller)
+
+        if style != "response" and notification_type in prefs.ignored:
+            return None
+
+        width = prefs.width
+        if width is None:
+            if session and 'SCREENWIDTH' in session.protocol_flags:
+                width = session.protocol_flags['SCREENWIDTH'][0] - 2
+            else:
+                width = 78
+
+        prefix = prefs.prefixes.get(notification_type, "")
+        return prefix, width, prefs.response_color, prefs.border_color
 
     def send_all(self, list=None):
         """
@@ -231,7 +431,7 @@ class Notification:
             return default
 
         result = 78
-        prefs = caller.db.notification_prefs or {}
+        prefs = NotificationPrefs.get_for(caller)
         if key == "width" and not "width" in prefs:
             # Special case for our default
             sessions = caller.sessions.get()
@@ -239,7 +439,7 @@ class Notification:
                 result = (sessions[0].protocol_flags['SCREENWIDTH'][0] - 2) if sessions[0].protocol_flags.has_key(
                     'SCREENWIDTH') else default
         else:
-            result = prefs[key] if key in prefs else default
+            result = prefs.get(key, default)
 
         return result
 
@@ -265,6 +465,7 @@ class Notification:
             del prefs[key]
 
         caller.db.notification_prefs = prefs
+        NotificationPrefs.invalidate(caller)
 
     @classmethod
     def known_types(cls):
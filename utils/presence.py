@@ -0,0 +1,219 @@
+"""
+A running snapshot of who is online.
+
+Rather than walking every session and reading attributes each time someone types 'who', the
+details who needs are kept in memory, one row per logged-in session, and updated as sessions
+log in, disconnect, change what they're puppeting or set their doing.  Alongside that is an
+index of which online Characters are in which room, updated as Characters are puppeted,
+unpuppeted and moved, for the where command.  The snapshot is built from the session handler
+the first time it's used, so it survives a server reload.
+"""
+import bisect
+from collections import OrderedDict
+
+from evennia.server.sessionhandler import SESSIONS
+from evennia.utils import utils
+
+
+class SessionRow(object):
+    """
+    Everything the who list shows about a single logged-in session, other than the times, which
+    are read from the session when needed since they're always changing.
+    """
+
+    __slots__ = ('session', 'account', 'name', 'key', 'doing', 'puppet', 'address', '_client')
+
+    def __init__(self, session):
+        account = session.get_account()
+        self.session = session
+        self.account = account
+        self.name = utils.crop(account.key, 20)
+        self.key = account.key.lower()
+        self.address = session.address[0] if isinstance(session.address, tuple) else session.address
+        self._client = None
+        self.refresh()
+
+    def refresh(self):
+        """
+        Re-reads the parts of the row that can change while the session is connected.
+        """
+        self.doing = self.account.db.who_doing or ""
+        self.puppet = self.session.get_puppet()
+
+    @property
+    def conn_time(self):
+        return self.session.conn_time
+
+    @property
+    def cmd_last_visible(self):
+        return self.session.cmd_last_visible
+
+    @property
+    def client(self):
+        """
+        A sane name for the client this session is using.  Clients can report their names some
+        time after connecting, so this isn't remembered until there's a name to remember.
+        """
+        if self._client:
+            return self._client
+
+        session = self.session
+        if session.protocol_key == "websocket" or "ajax" in session.protocol_key:
+            self._client = "Web Client"
+            return self._client
+
+        client_name = session.protocol_flags.get('CLIENTNAME') or session.protocol_flags.get('TERM')
+        if not client_name:
+            return "Unknown"
+
+        if client_name.upper().endswith("-256COLOR"):
+            client_name = client_name[:-9]
+
+        self._client = client_name.capitalize()
+        return self._client
+
+
+class PresenceHandler(object):
+    """
+    Keeps a SessionRow for every logged-in session, in the order they connected, along with an
+    index of lowercased account names for finding everyone whose name starts with a prefix, and
+    the online Characters in each room.
+    """
+
+    def __init__(self):
+        self.rows = None
+        self.index = []
+        self.rooms = {}
+        self.locations = {}
+
+    def load(self):
+        """
+        Builds the snapshot from the session handler, if it hasn't been built yet.
+
+        :return: A dictionary of session ids to SessionRows, in the order they connected.
+        """
+        if self.rows is None:
+            self.rows = OrderedDict()
+            self.index = []
+            self.rooms = {}
+            self.locations = {}
+            for session in sorted(SESSIONS.get_sessions(), key=lambda sess: sess.conn_time):
+                self.add(session)
+                puppet = session.get_puppet()
+                if puppet:
+                    self.place(puppet, puppet.location)
+
+        return self.rows
+
+    def add(self, session):
+        """
+        Adds or replaces the row for a session, if it's logged in.
+
+        :param session: The session.
+        """
+        if not session.logged_in or not session.get_account():
+            return
+
+        self.remove(session.sessid)
+        row = SessionRow(session)
+        self.rows[session.sessid] = row
+        bisect.insort(self.index, (row.key, session.sessid))
+
+    def remove(self, sessid):
+        """
+        Drops the row for a session, if there is one.
+
+        :param sessid: The session's id.
+        """
+        row = self.rows.pop(sessid, None)
+        if row:
+            del self.index[bisect.bisect_left(self.index, (row.key, sessid))]
+
+    def connect(self, session):
+        """
+        Adds a row for a session which has just logged in.
+
+        :param session: The session.
+        """
+        self.load()
+        self.add(session)
+
+    def disconnect(self, session):
+        """
+        Drops the row for a session which is disconnecting.
+
+        :param session: The session.
+        """
+        self.load()
+        self.remove(session.sessid)
+
+    def refresh_account(self, account):
+        """
+        Updates the rows for all of an account's sessions, such as when its doing changes or it
+        starts or stops puppeting a Character.
+
+        :param account: The account.
+        """
+        rows = self.load()
+        for session in account.sessions.get():
+            if session.sessid in rows:
+                rows[session.sessid].refresh()
+
+    def place(self, character, room):
+        """
+        Records which room an online Character is in.  A Character placed in the room it's
+        already in keeps its place in the order of arrivals.
+
+        :param character: The Character.
+        :param room: The room it's now in, or None if it's no longer online or anywhere.
+        """
+        self.load()
+        if self.locations.get(character) == room:
+            return
+
+        old = self.locations.pop(character, None)
+        if old is not None:
+            occupants = self.rooms[old]
+            occupants.remove(character)
+            if not occupants:
+                del self.rooms[old]
+
+        if room is not None:
+            self.locations[character] = room
+            self.rooms.setdefault(room, []).append(character)
+
+    def where(self):
+        """
+        Gets every room with online Characters in it.
+
+        :return: A dictionary of rooms to lists of the online Characters in them, in the order
+                 they arrived.
+        """
+        self.load()
+        return self.rooms
+
+    def who(self, prefix=None):
+        """
+        Gets the rows for everyone online, in the order they connected.
+
+        :param prefix: If given, only accounts whose names start with this (ignoring case) are
+                       included.
+        :return: A list of SessionRows.
+        """
+        rows = self.load()
+        if not prefix:
+            return rows.values()
+
+        prefix = prefix.lower()
+        matches = []
+        index = self.index
+        for i in range(bisect.bisect_left(index, (prefix,)), len(index)):
+            key, sessid = index[i]
+            if not key.startswith(prefix):
+                break
+            matches.append(rows[sessid])
+
+        return sorted(matches, key=lambda row: row.conn_time)
+
+
+PRESENCE = PresenceHandler()
@@ -0,0 +1,287 @@
+from django.test import SimpleTestCase
+from evennia import DefaultCharacter
+from mock import patch, PropertyMock
+
+from commands.command import PaxCommand
+from typeclasses.characters import Character
+from utils import text
+from utils.notifications import Notification, NotificationPrefs
+from utils.presence import PresenceHandler
+from utils.text import display_width
+
+
+class FakeSession(object):
+
+    def __init__(self, width, puppet=None):
+        self.protocol_flags = {'SCREENWIDTH': [width]}
+        self.puppet = puppet
+
+    def get_puppet(self):
+        return self.puppet
+
+
+class FakeSessions(object):
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    def get(self):
+        return self.sessions
+
+
+class FakeAttributes(object):
+    """
+    Stands in for a Character's attribute handler, counting how often the preferences are read.
+    """
+
+    def __init__(self, prefs):
+        self.prefs = prefs
+        self.reads = 0
+
+    @property
+    def notification_prefs(self):
+        self.reads += 1
+        return self.prefs
+
+
+class FakeNAttributes(object):
+    """
+    Stands in for a Character's ndb, which returns None for anything that isn't set.
+    """
+
+    def __getattr__(self, name):
+        return None
+
+
+class FakeCharacter(object):
+    """
+    A stand-in for a subscribed Character, so that the benchmark measures the fan-out itself
+    rather than the database.
+    """
+
+    typeclass = "typeclasses.characters.Character"
+
+    def __init__(self, prefs, online, width):
+        self.db = FakeAttributes(prefs)
+        self.ndb = FakeNAttributes()
+        self.sessions = FakeSessions([FakeSession(width)] if online else [])
+        self.received = []
+
+    def is_typeclass(self, typeclass):
+        return typeclass == self.typeclass
+
+    def msg(self, text, session=None, **kwargs):
+        # Like a real Character, nothing arrives anywhere without a session.
+        for target in ([session] if session else self.sessions.get()):
+            self.received.append((target, text))
+
+
+class FakeAccount(FakeCharacter):
+
+    typeclass = "typeclasses.accounts.Account"
+
+
+class CountingNotification(Notification):
+    """
+    A Notification which counts how many times it's been rendered.
+    """
+
+    renders = 0
+
+    def __str__(self):
+        CountingNotification.renders += 1
+        return Notification.__str__(self)
+
+
+class FakeLogin(object):
+    """
+    A logged-in session, as far as the who list is concerned.
+    """
+
+    def __init__(self, sessid, account, puppet=None):
+        self.sessid = sessid
+        self.account = account
+        self.puppet = puppet
+        self.logged_in = True
+        self.address = ("127.0.0.1", 4000)
+        self.conn_time = sessid
+        self.cmd_last_visible = sessid
+        self.protocol_key = "telnet"
+        self.protocol_flags = {}
+        account.sessions.sessions.append(self)
+
+    def get_account(self):
+        return self.account
+
+    def get_puppet(self):
+        return self.puppet
+
+
+class PresenceAccount(object):
+
+    def __init__(self, key):
+        self.key = key
+        self.db = FakeNAttributes()
+        self.sessions = FakeSessions([])
+
+
+class TestNotifications(SimpleTestCase):
+
+    def test_command_preference_reads(self):
+        caller = FakeCharacter({"prefixes": {"general": "|c>|n "}, "response_color": "|g"}, True, 80)
+        command = PaxCommand(caller=caller, cmdstring="display")
+
+        before = NotificationPrefs.reads
+        command.get_height()
+        command.notify("Display settings updated.")
+        command.get_notification(border=True, header="Display Settings").send(caller)
+
+        # A command reads its caller's preferences once, however many times it looks at them.
+        self.assertEqual(NotificationPrefs.reads - before, 1)
+        self.assertEqual(caller.db.reads, 1)
+
+    def test_account_sessions(self):
+        account = FakeAccount({}, False, 80)
+        character = FakeCharacter({"prefixes": {"general": "|c>|n "}}, False, 80)
+        account.sessions.sessions = [FakeSession(80, character) for _ in range(3)] + [FakeSession(80)]
+        character.sessions.sessions = account.sessions.sessions[:3]
+
+        notice = CountingNotification(account, width=78)
+        notice.add_line("Hello, everyone.")
+
+        before = CountingNotification.renders
+        notice.send(account)
+
+        # Every session gets exactly one copy, and the puppeting sessions share a rendering.
+        self.assertEqual(len(character.received), 3)
+        self.assertEqual(len(account.received), 1)
+        self.assertEqual(len(set(session for session, _ in character.received)), 3)
+        self.assertEqual(CountingNotification.renders - before, 2)
+
+    def test_multiline_response(self):
+        caller = FakeCharacter({"prefixes": {"general": "|c>|n "}}, True, 80)
+        response = Notification(caller, style="response", command="test")
+        response.add_line("First line")
+        response.add_line("Second line\nThird line")
+
+        # Every line of a multi-line response shows up, each with the prefix.
+        rendered = str(response)
+        self.assertEqual(rendered.count("\n"), 3)
+        for line in ("First line", "Second line", "Third line"):
+            self.assertIn(line, rendered)
+        self.assertEqual(rendered.count("|c>|n "), 3)
+
+
+class TestText(SimpleTestCase):
+
+    def test_display_width(self):
+        self.assertEqual(display_width("|wBoard|n"), 5)
+        self.assertEqual(display_width("|[B|555Colors|n"), 6)
+        self.assertEqual(display_width(u"e\u0301t\u00e9"), 3)
+        self.assertEqual(display_width(u"\u6f22\u5b57 kanji"), 10)
+        self.assertEqual(display_width(u"caf\u00e9".encode('utf-8')), 4)
+
+    def test_remembered_widths(self):
+        text._widths.clear()
+        display_width("|wRemembered|n")
+        self.assertEqual(text._widths, {"|wRemembered|n": 10})
+
+        with patch('evennia.utils.ansi.strip_ansi') as strip:
+            self.assertEqual(display_width("|wRemembered|n"), 10)
+            self.assertFalse(strip.called)
+
+        with patch.object(text, 'WIDTH_CACHE_SIZE', 2):
+            display_width("a")
+            display_width("bb")
+            self.assertEqual(len(text._widths), 1)
+            self.assertEqual(text._widths, {"bb": 2})
+
+
+class TestPresence(SimpleTestCase):
+
+    def setUp(self):
+        self.presence = PresenceHandler()
+        with patch('utils.presence.SESSIONS') as sessions:
+            sessions.get_sessions.return_value = []
+            self.presence.load()
+
+        self.accounts = [PresenceAccount(key) for key in ("Bob", "alfred", "Zed", "Alice")]
+        self.logins = [FakeLogin(i + 1, account) for i, account in enumerate(self.accounts)]
+        for login in self.logins:
+            self.presence.connect(login)
+
+    def names(self, prefix=None):
+        return [row.name for row in self.presence.who(prefix)]
+
+    def test_who_prefix(self):
+        self.assertEqual(self.names(), ["Bob", "alfred", "Zed", "Alice"])
+        self.assertEqual(self.names(""), ["Bob", "alfred", "Zed", "Alice"])
+        self.assertEqual(self.names("AL"), ["alfred", "Alice"])
+        self.assertEqual(self.names("alic"), ["Alice"])
+        self.assertEqual(self.names("z"), ["Zed"])
+        self.assertEqual(self.names("zz"), [])
+        self.assertEqual(self.names("0"), [])
+
+    def test_disconnect(self):
+        self.presence.disconnect(self.logins[3])
+        self.assertEqual(self.names("al"), ["alfred"])
+        self.assertEqual(len(self.presence.index), 3)
+
+        # Logging in again replaces the row, rather than adding another.
+        self.presence.connect(self.logins[0])
+        self.presence.connect(self.logins[0])
+        self.assertEqual(self.names("b"), ["Bob"])
+        self.assertEqual(self.names(), ["alfred", "Zed", "Bob"])
+
+    def test_refresh_account(self):
+        puppet = object()
+        self.logins[0].puppet = puppet
+        self.accounts[0].db.who_doing = "Testing"
+        self.presence.refresh_account(self.accounts[0])
+
+        row = self.presence.who("bob")[0]
+        self.assertIs(row.puppet, puppet)
+        self.assertEqual(row.doing, "Testing")
+
+    def test_place(self):
+        hall, garden = "Hall", "Garden"
+        first, second = "First", "Second"
+
+        self.presence.place(first, hall)
+        self.presence.place(second, hall)
+        self.assertEqual(self.presence.where(), {hall: [first, second]})
+
+        # Moving takes a Character out of its old room, and empty rooms aren't listed.
+        self.presence.place(first, garden)
+        self.presence.place(second, garden)
+        self.assertEqual(self.presence.where(), {garden: [first, second]})
+
+        # Unpuppeting leaves a Character nowhere.
+        self.presence.place(first, None)
+        self.presence.place(first, None)
+        self.assertEqual(self.presence.where(), {garden: [second]})
+        self.assertNotIn(first, self.presence.locations)
+
+    def test_character_moves(self):
+        hall, garden = "Hall", "Garden"
+        character = Character(id=1)
+        with patch('typeclasses.characters.PRESENCE', self.presence), \
+                patch.object(DefaultCharacter, 'save'), \
+                patch.object(Character, 'sessions') as sessions, \
+                patch.object(Character, 'location', new_callable=PropertyMock) as location:
+            # Any change of location is seen, even one made without move hooks.
+            sessions.count.return_value = 1
+            location.return_value = hall
+            character.save(update_fields=['db_location'])
+            self.assertEqual(self.presence.where(), {hall: [character]})
+
+            # Saving other fields, or moving while offline, leaves the index alone.
+            location.return_value = garden
+            character.save(update_fields=['db_key'])
+            sessions.count.return_value = 0
+            character.save(update_fields=['db_location'])
+            self.assertEqual(self.presence.where(), {hall: [character]})
+
+            sessions.count.return_value = 1
+            character.save()
+            self.assertEqual(self.presence.where(), {garden: [character]})
@@ -0,0 +1,50 @@
+"""
+Helpers for laying out text that contains Evennia color codes.
+"""
+import unicodedata
+
+from evennia.utils import ansi
+
+# How many strings to remember the width of, before starting over.
+WIDTH_CACHE_SIZE = 1024
+
+_widths = {}
+
+
+def display_width(text):
+    """
+    Works out how many columns a string takes up on screen.  Color codes take up no room,
+    combining characters (such as accents added to the letter before them) take up none either,
+    and wide characters (such as most Chinese, Japanese and Korean characters) take up two.
+    Widths are remembered, since the same titles and labels are measured over and over.
+
+    :param text: The text to measure, which may contain color codes.
+    :return: The width of the text, in columns.
+    """
+    width = _widths.get(text)
+    if width is None:
+        plain = ansi.strip_ansi(text)
+        if isinstance(plain, str):
+            try:
+                plain = plain.decode('utf-8')
+            except UnicodeDecodeError:
+                # Not text we know how to measure, so fall back to one column a byte.
+                plain = plain.decode('latin-1')
+
+        width = 0
+        for char in plain:
+            if char < u"\u0300":
+                # Nothing before the combining accents is wide or zero-width.
+                width += 1
+            elif unicodedata.combining(char) or unicodedata.category(char) in ('Mn', 'Me', 'Cf'):
+                continue
+            elif unicodedata.east_asian_width(char) in ('W', 'F'):
+                width += 2
+            else:
+                width += 1
+
+        if len(_widths) >= WIDTH_CACHE_SIZE:
+            _widths.clear()
+        _widths[text] = width
+
+    return width